@@ -1,10 +1,13 @@
 import os
 from flask import Flask
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy.engine import make_url
 from urllib.parse import urlparse
 
+from src import storage
 from src.endpoints import api_bp
-from src.extensions import db
+from src.extensions import db, create_schema, ORJSONProvider
 
 # API Host, default to 0.0.0.0 if not specified
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
@@ -14,6 +17,8 @@ API_PORT = int(os.getenv("API_PORT", "8000"))
 DEV = os.getenv("FLASK_STAGE", "dev") == "dev"
 # Wheter or not SSL is enabled
 SSL_ENABLE = os.getenv("SSL_ENABLE", "false").lower() == "true"
+# number of reverse proxies (e.g. nginx) in front of the api, 0 if clients connect directly
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "0"))
 
 # apply CORS to the frontend url
 frontend_url = os.getenv("FRONTEND_URL")
@@ -26,9 +31,12 @@ api_base = os.getenv(
 parsed = urlparse(api_base)
 
 
-def create_app():
+def create_app(config: dict | None = None):
     app = Flask(__name__)
 
+    # serialize json responses with orjson
+    app.json = ORJSONProvider(app)
+
     # Core config
     app.config.update(
         # put database at /app/src/data/auth.db
@@ -41,6 +49,12 @@ def create_app():
         IMAGE_UPLOAD_FOLDER="/app/src/data/images",
         # set max file size to 16Mb
         MAX_CONTENT_LENGTH=16 * 1000 * 1000,
+        # internal nginx location for images, hands file transfers to the proxy when set
+        X_ACCEL_IMAGES=os.getenv("X_ACCEL_IMAGES"),
+        # apache / lighttpd equivalent, send_from_directory answers with an X-Sendfile header
+        USE_X_SENDFILE=os.getenv("USE_X_SENDFILE", "false").lower() == "true",
+        # fully decode uploads with PIL instead of only checking the jpeg magic bytes
+        VERIFY_IMAGES=os.getenv("VERIFY_IMAGES", "false").lower() == "true",
 
         # e.g. "localhost:8000" or "api.keepcooking.recipes"
         SERVER_NAME=parsed.netloc,
@@ -48,8 +62,30 @@ def create_app():
         PREFERRED_URL_SCHEME=parsed.scheme,
     )
 
+    # overrides (e.g. the tests' database and image folder), applied before anything is initialized
+    if config:
+        app.config.update(config)
+
+    # keep one pooled connection per gunicorn thread, so requests reuse an open connection
+    # (with its pragmas and page cache) instead of overflowing into a new one each time,
+    # plus a few for background work like rehashing
+    # no pre ping or recycle, the database is a local file
+    # in-memory sqlite gets a StaticPool from flask-sqlalchemy, which takes no pool sizes
+    if make_url(app.config["SQLALCHEMY_DATABASE_URI"]).database not in (None, "", ":memory:"):
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {
+            "pool_size": int(os.getenv("GUNICORN_THREADS", "8")),
+            "max_overflow": 4,
+        })
+
     # Init extensions
     db.init_app(app)
+    storage.init_app(app)
+
+    # behind a reverse proxy every request comes from the proxy's address,
+    # take the client address (used to limit password hashing per client) and scheme
+    # from the X-Forwarded headers the trusted proxies set
+    if TRUSTED_PROXIES:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
 
     # Blueprints & CORS
     CORS(app, resources={r"/api/*": {"origins": CORS_ORIGINS}}, supports_credentials=True)
@@ -57,13 +93,14 @@ def create_app():
 
     # Create DB tables once per process startup
     with app.app_context():
-        db.create_all()
+        create_schema()
 
     return app
 
-app = create_app()
 
 if __name__ == "__main__":
+    app = create_app()
+
     ssl_context = None
     if SSL_ENABLE:
         cert = os.getenv("SSL_CERT_PATH")
@@ -1,32 +1,149 @@
-from datetime import datetime, timedelta, timezone
-import os, jwt, string
+from dataclasses import dataclass
+from threading import Lock
+import os, re, jwt, string, time, secrets, hashlib, hmac, base64, orjson
+from cachetools import TLRUCache
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
 from flask import request, Response
-from pydantic import BaseModel, Field, EmailStr, field_validator
+from email_validator import SPECIAL_USE_DOMAIN_NAMES
+from pydantic.networks import validate_email
+from pydantic_core import PydanticCustomError
+
+
+# digests for the hmac jwt algorithms
+_HMAC_DIGESTS = {"HS256": hashlib.sha256, "HS384": hashlib.sha384, "HS512": hashlib.sha512}
+
+
+def _cpu_flags() -> set[str]:
+    # cpu feature flags from /proc/cpuinfo ("flags" on x86, "Features" on arm)
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith(("flags", "Features")):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+
+def _hmac_algorithm() -> str:
+    # JWT_ALGORITHM picks the hmac algorithm, HS512 by default
+    # "auto" picks HS256 when the cpu accelerates sha-256 (SHA-NI / armv8 sha2) but not sha-512
+    algorithm = os.environ.get("JWT_ALGORITHM", "HS512").upper()
+    if algorithm == "AUTO":
+        flags = _cpu_flags()
+        return "HS256" if flags & {"sha_ni", "sha2"} and "sha512" not in flags else "HS512"
+
+    if algorithm not in _HMAC_DIGESTS:
+        raise RuntimeError("JWT_ALGORITHM must be one of HS256, HS384, HS512, or auto")
+    return algorithm
+
+
+def _load_jwt_keys() -> tuple[str, bytes | Ed25519PrivateKey, bytes | Ed25519PublicKey]:
+    # returns the jwt algorithm, signing key, and verifying key
+    # an Ed25519 private key switches to EdDSA, so other services can validate
+    # tokens offline with only the public key instead of sharing a secret
+    pem = os.environ.get("JWT_PRIVATE_KEY")
+    if pem:
+        private_key = load_pem_private_key(pem.encode(), password=None)
+        if not isinstance(private_key, Ed25519PrivateKey):
+            raise RuntimeError("JWT_PRIVATE_KEY must be an Ed25519 private key")
+        return "EdDSA", private_key, private_key.public_key()
+
+    # custom JWT secret or random 64 bytes
+    # kept as bytes so it's never re-encoded when signing or validating
+    secret = os.environ.get("JWT_SECRET")
+    if not secret and int(os.environ.get("WEB_CONCURRENCY", "1")) > 1:
+        # each worker would sign with its own random key and reject the others' tokens
+        raise RuntimeError("JWT_SECRET or JWT_PRIVATE_KEY must be set when running more than one worker")
+    secret = secret.encode() if secret else os.urandom(64)
+    return _hmac_algorithm(), secret, secret
+
+
+def _b64(data: bytes) -> bytes:
+    # base64url without padding, as used by jwt
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
 
 
 class Auth:
-    __JWT_SECRET = os.environ.get("JWT_SECRET", os.urandom(64)) # custom JWT secret or random 64 bytes
-    __ACCESS_TTL_HOURS = 24 # 24 hour TTL
+    __JWT_ALGORITHM, __JWT_SIGNING_KEY, __JWT_VERIFY_KEY = _load_jwt_keys()
+    __JWT_DIGEST = _HMAC_DIGESTS.get(__JWT_ALGORITHM) # None for non-hmac algorithms
+    __JWT_HEADER_B64 = _b64(orjson.dumps({"alg": __JWT_ALGORITHM, "typ": "JWT"})) # the header never changes
+    __JWT_ALGORITHMS = [__JWT_ALGORITHM] # accepted algorithms when decoding
+    __JWT_DECODE_OPTIONS = {"require": ["sub", "exp", "iat"]} # require subject, expiry time, and time of initialization
+    __ACCESS_TTL_SECONDS = 10 * 60 # 10 minute TTL, sessions are kept alive by the refresh token
+    __REFRESH_TTL_DAYS = 30 # 30 day TTL
     __COOKIE_DOMAIN = os.environ.get("COOKIE_DOMAIN", None)
     __COOKIE_SECURE = os.getenv("SSL_ENABLE", "false").lower() == "true" # enable secure cookies if SSL is enabled
-    __JWT_ALGORITHM = "HS512" # use HS512 algorithm
     __COOKIE_NAME = "access_token" # jwt cookie name
+    __REFRESH_COOKIE_NAME = "refresh_token" # refresh token cookie name
+
+    # validated tokens -> (user id, expiry), each entry is dropped once its token expires
+    __TOKEN_CACHE: TLRUCache = TLRUCache(maxsize=10_000, ttu=lambda _token, value, _now: value[1], timer=time.time)
+    __TOKEN_CACHE_LOCK = Lock()
 
     @staticmethod
     def issue_access(user_id: int) -> str:
         # create a jwt token
         # set time of initialization, time of expiry, and identify user by id
-        now = datetime.now(timezone.utc)
+        now = int(time.time())
         payload = {
             "sub": str(user_id), # subject
-            "iat": int(now.timestamp()), # time of initialization
-            "exp": int((now + timedelta(hours=Auth.__ACCESS_TTL_HOURS)).timestamp()), # time of expiry
+            "iat": now, # time of initialization
+            "exp": now + Auth.__ACCESS_TTL_SECONDS, # time of expiry
         }
-        return jwt.encode(payload, Auth.__JWT_SECRET, algorithm=Auth.__JWT_ALGORITHM)
+
+        # hmac tokens are signed directly, reusing the encoded header instead of going through pyjwt
+        if Auth.__JWT_DIGEST:
+            signing_input = Auth.__JWT_HEADER_B64 + b"." + _b64(orjson.dumps(payload))
+            signature = hmac.new(Auth.__JWT_SIGNING_KEY, signing_input, Auth.__JWT_DIGEST).digest()
+            return (signing_input + b"." + _b64(signature)).decode()
+
+        return jwt.encode(payload, Auth.__JWT_SIGNING_KEY, algorithm=Auth.__JWT_ALGORITHM)
+
+    @staticmethod
+    def issue_refresh() -> tuple[str, str, int]:
+        # create an opaque refresh token
+        # returns the token for the cookie, the hash to store, and the time of expiry
+        token = secrets.token_urlsafe(32)
+        expires_at = int(time.time()) + Auth.__REFRESH_TTL_DAYS * 86400
+        return token, Auth.hash_refresh(token), expires_at
+
+    @staticmethod
+    def hash_refresh(token: str) -> str:
+        # only the hash of a refresh token is stored
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @staticmethod
+    def has_session_cookies() -> bool:
+        # whether the request carries a jwt token or a refresh token at all
+        cookies = request.cookies
+        return Auth.__COOKIE_NAME in cookies or Auth.__REFRESH_COOKIE_NAME in cookies
+
+    @staticmethod
+    def refresh_token() -> str | None:
+        # get the refresh token from the cookie header
+        return request.cookies.get(Auth.__REFRESH_COOKIE_NAME) or None
+
+    @staticmethod
+    def set_refresh_cookie(resp: Response, value: str) -> None:
+        # set the refresh token to its own cookie
+        Auth.set_cookie(resp, name=Auth.__REFRESH_COOKIE_NAME, value=value, max_age=Auth.__REFRESH_TTL_DAYS * 86400)
+
+    @staticmethod
+    def clear_refresh_cookie(resp: Response) -> None:
+        # clear the refresh token
+        Auth.clear_cookie(resp, name=Auth.__REFRESH_COOKIE_NAME)
+
+    @staticmethod
+    def sets_access_cookie(resp: Response) -> bool:
+        # whether the response already sets (or clears) the jwt cookie
+        prefix = f"{Auth.__COOKIE_NAME}="
+        return any(cookie.startswith(prefix) for cookie in resp.headers.getlist("Set-Cookie"))
 
     @staticmethod
     def set_cookie(resp: Response, name: str = __COOKIE_NAME, value: str = "", 
-                   max_age: int = __ACCESS_TTL_HOURS * 3600, http_only: bool = True, path: str = "/") -> None:
+                   max_age: int = __ACCESS_TTL_SECONDS, http_only: bool = True, path: str = "/") -> None:
         # set jwt token to the cookie
         resp.set_cookie(
             name, value,
@@ -39,6 +156,12 @@ class Auth:
 
     @staticmethod
     def clear_cookie(resp: Response, name: str = __COOKIE_NAME, http_only: bool = True, path: str = "/") -> None:
+        # forget the token being cleared so it has to be fully validated again
+        token = request.cookies.get(name)
+        if token:
+            with Auth.__TOKEN_CACHE_LOCK:
+                Auth.__TOKEN_CACHE.pop(token, None)
+
         # clear the jwt token
         resp.set_cookie(name, "", expires=0, path=path, domain=Auth.__COOKIE_DOMAIN, secure=Auth.__COOKIE_SECURE, httponly=http_only)
 
@@ -51,69 +174,162 @@ class Auth:
         if not token:
             return None
 
+        # skip the signature check if this token was already validated and hasn't expired
+        with Auth.__TOKEN_CACHE_LOCK:
+            cached = Auth.__TOKEN_CACHE.get(token)
+        if cached:
+            return cached[0]
+
         # Try to decode the jwt token with the secret, enforcing fields to exist
         try:
             payload = jwt.decode(
                 token,
-                Auth.__JWT_SECRET,
-                algorithms=[Auth.__JWT_ALGORITHM],
-                # require subject, expiry time, and time of initialization
-                options={"require": ["sub", "exp", "iat"]}, 
+                Auth.__JWT_VERIFY_KEY,
+                algorithms=Auth.__JWT_ALGORITHMS,
+                options=Auth.__JWT_DECODE_OPTIONS,
             )
         except jwt.PyJWTError:
             # If the jwt token failed to decode or is invalid, return None
             return None
 
+        # cache the subject until the token expires
+        uid = int(payload["sub"])
+        with Auth.__TOKEN_CACHE_LOCK:
+            Auth.__TOKEN_CACHE[token] = (uid, payload["exp"])
+
         # return subject if it successfully decoded (valid jwt token)
-        return int(payload["sub"])
+        return uid
     
 
-class UserRegistration(BaseModel):
-    username: str = Field(...)
-    email: EmailStr
-    password: str = Field(...)
-
-    @field_validator('username')
-    @classmethod
-    def validate_username(cls, v: str) -> str:
-        if not v or len(v) < 1:
-            raise ValueError('Username must have at least 1 character')
-        if len(v) > 64:
+# plain ascii addresses that the full email validator always accepts
+# anything else (quoting, unicode, punycode, etc.) goes through the full validator
+_EMAIL_RE = re.compile(
+    r"[A-Za-z0-9_%+\-]{1,64}(?:\.[A-Za-z0-9_%+\-]+)*"
+    r"@((?:[A-Za-z0-9](?:[A-Za-z0-9\-]{0,61}[A-Za-z0-9])?\.)+[A-Za-z]{2,63})"
+)
+
+
+def _is_plain_email(v: str) -> bool:
+    match = _EMAIL_RE.fullmatch(v)
+    if not match or len(v) > 254 or v.index("@") > 64:
+        return False
+
+    # leave reserved domains (i.e. .test, .local) and "ab--" style labels to the full validator
+    domain = match[1].lower()
+    if "--" in domain:
+        return False
+    return not any(domain == name or domain.endswith("." + name) for name in SPECIAL_USE_DOMAIN_NAMES)
+
+
+# character class bits for the password strength check
+_LOWER, _UPPER, _DIGIT, _SPECIAL = 1, 2, 4, 8
+
+
+def _char_class(c: str) -> int:
+    return (
+        (_LOWER if c.islower() else 0)
+        | (_UPPER if c.isupper() else 0)
+        | (_DIGIT if c.isdigit() else 0)
+        | (_SPECIAL if c in string.punctuation else 0)
+    )
+
+
+# precomputed classes for every ascii character
+_ASCII_CLASSES = [_char_class(chr(i)) for i in range(128)]
+
+# ascii characters of each class, scanned in C for ascii-only passwords
+_ASCII_LOWER = frozenset(string.ascii_lowercase)
+_ASCII_UPPER = frozenset(string.ascii_uppercase)
+_ASCII_DIGIT = frozenset(string.digits)
+_ASCII_SPECIAL = frozenset(string.punctuation)
+
+
+def _password_classes(v: str) -> int:
+    # ascii passwords use C-level set scans that stop at the first match of each class
+    if v.isascii():
+        return (
+            (0 if _ASCII_LOWER.isdisjoint(v) else _LOWER)
+            | (0 if _ASCII_UPPER.isdisjoint(v) else _UPPER)
+            | (0 if _ASCII_DIGIT.isdisjoint(v) else _DIGIT)
+            | (0 if _ASCII_SPECIAL.isdisjoint(v) else _SPECIAL)
+        )
+
+    # otherwise classify every character in a single pass
+    # ascii goes through the lookup table, anything else is classified directly
+    seen = 0
+    for c in v:
+        o = ord(c)
+        seen |= _ASCII_CLASSES[o] if o < 128 else _char_class(c)
+    return seen
+
+
+@dataclass(slots=True)
+class UserRegistration:
+    # validated signup fields, plain checks instead of a pydantic model on the signup path
+    # raises ValueError with the message for the first invalid field
+    username: str
+    email: str
+    password: str
+
+    def __post_init__(self):
+        if not (isinstance(self.username, str) and isinstance(self.email, str) and isinstance(self.password, str)):
+            raise ValueError('Input should be a valid string')
+
+        self.username = self.validate_username(self.username)
+        self.email = self.validate_email(self.email)
+        self.password = self.validate_password_strength(self.password)
+
+    @staticmethod
+    def validate_username(v: str) -> str:
+        # one range check on the common path, pick the message only on failure
+        n = len(v)
+        if not 1 <= n <= 64:
+            if n < 1:
+                raise ValueError('Username must have at least 1 character')
             raise ValueError('Username must be at most 64 characters')
         return v
 
-    @field_validator('email')
-    @classmethod
-    def validate_email(cls, v: EmailStr) -> EmailStr:
-        # EmailStr validation happens first, then this
-        if len(str(v)) > 255:
+    @staticmethod
+    def validate_email(v: str) -> str:
+        if len(v) > 255:
             raise ValueError('Please enter a valid email address')
-        return v
 
-    @field_validator('password')
-    @classmethod
-    def validate_password_strength(cls, v: str) -> str:
-        # Check length constraints first
-        if len(v) < 8:
-            raise ValueError('Password must be at least 8 characters')
+        # most addresses match the precompiled pattern, skip the full validator for those
+        if _is_plain_email(v):
+            return v
 
-        if len(v) > 128:
+        # otherwise fall back to the full email validator
+        try:
+            return validate_email(v)[1]
+        except PydanticCustomError:
+            raise ValueError('Please enter a valid email address')
+
+    @staticmethod
+    def validate_password_strength(v: str) -> str:
+        # Check length constraints first, as one range check on the common path
+        n = len(v)
+        if not 8 <= n <= 128:
+            if n < 8:
+                raise ValueError('Password must be at least 8 characters')
             raise ValueError('Password must be at most 128 characters')
 
+        # Find which character classes the password contains
+        seen = _password_classes(v)
+
         # Validate that it has at least one lowercase letter
-        if not any(c.islower() for c in v):
+        if not seen & _LOWER:
             raise ValueError('Password must have at least one lowercase letter')
 
         # Validate that it has at least one uppercase letter
-        if not any(c.isupper() for c in v):
+        if not seen & _UPPER:
             raise ValueError('Password must have at least one uppercase letter')
 
         # Validate numbers
-        if not any(c.isdigit() for c in v):
+        if not seen & _DIGIT:
             raise ValueError('Password must have at least one number')
 
         # Validate special characters
-        if not any(c in string.punctuation for c in v):
+        if not seen & _SPECIAL:
             raise ValueError('Password must have at least one special character')
 
         return v
@@ -1,28 +1,103 @@
+from functools import wraps
 from http import HTTPStatus
-from flask import jsonify, request, g, make_response
+from threading import Lock
+import orjson
+from flask import Response, jsonify, request, g, make_response
 from sqlalchemy.exc import IntegrityError
-from pydantic import ValidationError
 
 from src.extensions import db
-from src.models import User
+from src.models import User, UserView, RefreshToken
 from src.auth import Auth, UserRegistration
-from .blueprint import api_bp
+from .blueprint import api_bp, json_body
+
+
+# endpoints that never use the current user, authentication is skipped for them
+PUBLIC_ENDPOINTS = {"api.signup", "api.login", "api.logout", "api.refresh"}
+
+
+# /me body for anonymous clients, serialized once since frontends poll it for login state
+_ANON_ME_BODY = orjson.dumps({"authenticated": False})
+
+
+# password hashes a single client may have running at once
+MAX_HASHING_PER_CLIENT = 2
+
+# client address -> number of password hashes in flight
+_hashing: dict[str, int] = {}
+_hashing_lock = Lock()
+
+
+def limit_concurrent_hashing(view):
+    # sheds load with 429 instead of queueing argon2 work
+    # when a client already has too many password hashes running (i.e. credential stuffing)
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # the forwarded client address behind a proxy (TRUSTED_PROXIES), not the proxy's
+        client = request.remote_addr or ""
+
+        with _hashing_lock:
+            in_flight = _hashing.get(client, 0)
+            if in_flight >= MAX_HASHING_PER_CLIENT:
+                return jsonify(error="Too many requests"), HTTPStatus.TOO_MANY_REQUESTS
+            _hashing[client] = in_flight + 1
+
+        try:
+            return view(*args, **kwargs)
+        finally:
+            with _hashing_lock:
+                if _hashing[client] <= 1:
+                    del _hashing[client]
+                else:
+                    _hashing[client] -= 1
+
+    return wrapper
 
 
 @api_bp.before_request
 def load_user():
     # runs before every request
+    # public endpoints don't need the jwt token validated or the user loaded
+    # and anonymous requests have no tokens to validate
+    if request.endpoint in PUBLIC_ENDPOINTS or not Auth.has_session_cookies():
+        g.user = None
+        return
+
     # checks if the request sent a jwt token and finds the user if so
     uid = Auth.validate_jwt()
-    g.user = db.session.get(User, uid) if uid else None
+
+    # if the jwt token is missing or expired, renew it from the refresh token
+    if not uid:
+        uid = RefreshToken.user_for(Auth.refresh_token())
+        if uid:
+            g.renewed_access = Auth.issue_access(uid)
+
+    g.user = User.view(uid) if uid else None
+
+
+@api_bp.after_request
+def renew_access(resp):
+    # attach the renewed jwt token, unless the endpoint set or cleared it itself
+    token = g.pop("renewed_access", None)
+    if token and not Auth.sets_access_cookie(resp):
+        Auth.set_cookie(resp, value=token)
+    return resp
+
+
+def start_session(resp, user_id: int) -> None:
+    # attach a new jwt token and refresh token to the response
+    # the jwt token's subject is the user id
+    Auth.set_cookie(resp, value=Auth.issue_access(user_id))
+    Auth.set_refresh_cookie(resp, RefreshToken.issue(user_id))
 
 
 @api_bp.post("/signup")
+@limit_concurrent_hashing
 def signup():
-    # Get json from body without erroring
-    # Must send with mimetype/JSON
+    # Get json from body
     # If there's nothing, data = {}
-    data: dict = request.get_json(silent=True) or {}
+    data = json_body()
+    if data is None:
+        return jsonify(error="Invalid JSON body"), HTTPStatus.BAD_REQUEST
 
     username = (data.get("username") or "").strip()
     email = (data.get("email") or "").strip().lower()
@@ -35,20 +110,9 @@ def signup():
             password=password
         )
         # Validation passed, continue with registration
-    except ValidationError as e:
-        # Extract first error message for cleaner response
-        error = e.errors()[0]
-        error_msg = error['msg']
-
-        # Custom message for email validation errors
-        if error['loc'][0] == 'email' and error['type'] == 'value_error':
-            error_msg = "Please enter a valid email address"
-        else:
-            # Remove Pydantic's "Value error, " prefix if present
-            if error_msg.startswith("Value error, "):
-                error_msg = error_msg[len("Value error, "):]
-
-        return jsonify(error=error_msg), HTTPStatus.BAD_REQUEST
+    except ValueError as e:
+        # the message of the first invalid field
+        return jsonify(error=str(e)), HTTPStatus.BAD_REQUEST
 
     try:
         # pass username, email, and plaintext password to database
@@ -65,22 +129,22 @@ def signup():
         user.admin = True
         db.session.commit()
 
-    # issue access with the subject being the user id
-    token = Auth.issue_access(user.id)
     # Create a response with status CREATED
     resp = make_response(jsonify(message="Account created"), HTTPStatus.CREATED)
-    # attach the cookie to the response
-    Auth.set_cookie(resp, value=token)
+    # attach the session cookies to the response
+    start_session(resp, user.id)
 
     return resp
 
 
 @api_bp.post("/login")
+@limit_concurrent_hashing
 def login():
-    # Get json from body without erroring
-    # Must send with mimetype/JSON
+    # Get json from body
     # If there's nothing, data = {}
-    data: dict = request.get_json(silent=True) or {}
+    data = json_body()
+    if data is None:
+        return jsonify(error="Invalid JSON body"), HTTPStatus.BAD_REQUEST
 
     # check if username and password exist in request data
     username = data.get("username", None)
@@ -90,50 +154,69 @@ def login():
     if not username or not password:
         return jsonify(error="Username and Password required"), HTTPStatus.BAD_REQUEST
 
-    # get the user by the username
-    user = User.by_username(username)
-
     # check if the user exists and validate the password against the hashed password
     # rehash the password if necessary (i.e. argon2 parameters changed)
-    if not user or not user.verify_and_maybe_rehash(password):
+    uid = User.authenticate(username, password)
+    if not uid:
         return jsonify(error="Invalid credentials"), HTTPStatus.UNAUTHORIZED
 
-    # issue access with the subject being the user id
-    token = Auth.issue_access(user.id)
     # Create a response with status OK
     resp = make_response(jsonify(message="Successfully authenticated"), HTTPStatus.OK)
-    # attach the cookie to the response
-    Auth.set_cookie(resp, value=token)
+    # attach the session cookies to the response
+    start_session(resp, uid)
+
+    return resp
+
+
+@api_bp.post("/refresh")
+def refresh():
+    # issue a new jwt token if the refresh token is still valid
+    uid = RefreshToken.user_for(Auth.refresh_token())
+
+    if not uid:
+        return jsonify(error="Not authenticated"), HTTPStatus.UNAUTHORIZED
 
+    # create a response with status OK
+    resp = make_response(jsonify(message="Session refreshed"), HTTPStatus.OK)
+    # attach the new jwt token to the response
+    Auth.set_cookie(resp, value=Auth.issue_access(uid))
     return resp
 
 
 @api_bp.post("/logout")
 def logout():
+    # revoke the refresh token so the session can't be renewed
+    RefreshToken.revoke(Auth.refresh_token())
+
     # create a response with status OK
     resp = make_response(jsonify(message="Successfully logged out"), HTTPStatus.OK)
-    # clear the cookie with the response
+    # clear the cookies with the response
     Auth.clear_cookie(resp)
+    Auth.clear_refresh_cookie(resp)
     return resp
 
 
 @api_bp.post("/remove-account")
 def remove_account():
-    user: User | None = g.user
+    user: UserView | None = g.user
 
     # if not authenticated, return unauthorized
     if not user:
         return jsonify(error="Not authenticated"), HTTPStatus.UNAUTHORIZED
 
     # delete the user and all of their posts
-    db.session.delete(user)
-    db.session.commit()
+    account = db.session.get(User, user.id)
+    if account:
+        db.session.delete(account)
+        db.session.commit()
 
     # create a response with status OK
     resp = make_response(jsonify(message="Successfully deleted account"), HTTPStatus.OK)
 
-    # clear the cookie with the response to log the user out
+    # clear the cookies with the response to log the user out
+    # the refresh tokens were deleted along with the user
     Auth.clear_cookie(resp)
+    Auth.clear_refresh_cookie(resp)
 
     return resp
 
@@ -141,10 +224,11 @@ def remove_account():
 @api_bp.get("/me")
 def me():
     # quick endpoint to check if the user is authenticated with jwt or not
-    user: User | None = g.user
+    user: UserView | None = g.user
 
     if not user:
-        return jsonify(authenticated=False), HTTPStatus.OK
+        # fresh response per request (cookies may be attached later), prebuilt body
+        return Response(_ANON_ME_BODY, HTTPStatus.OK, mimetype="application/json")
 
     return jsonify(
         authenticated=True, 
@@ -1,3 +1,23 @@
-from flask import Blueprint
+import orjson
+from flask import Blueprint, request
 
 api_bp = Blueprint("api", __name__)
+
+
+def json_body() -> dict | None:
+    # parse the raw request body as a json object, {} if there's no body
+    # returns None if the body isn't a valid json object
+    raw = request.get_data(cache=False)
+    if not raw:
+        return {}
+
+    # only json content types, a cross-site form can post text/plain without a preflight
+    if request.mimetype != "application/json":
+        return None
+
+    try:
+        data = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return None
+
+    return data if isinstance(data, dict) else None
@@ -1,73 +1,187 @@
+import base64, orjson
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
-from flask import jsonify, request, g, url_for, current_app, send_from_directory
-from sqlalchemy import asc, desc, and_
+from flask import Response, jsonify, request, g, current_app, send_from_directory
+from sqlalchemy import Row, and_, or_, func, select, update, delete, tuple_
+from sqlalchemy.orm import joinedload, undefer
 from datetime import date
-from pathlib import Path
 from uuid import uuid4
 from PIL import Image
 from pydantic_ai import BinaryImage
 
 from src.mcp import image_agent, RecipeOutput, ImageOutput
+from src import storage
 from src.extensions import db
-from src.models import User, Post
+from src.models import User, UserView, Post
 from .blueprint import api_bp
 
 
-def is_valid_image(file_stream):
+# writes uploads to disk while the image agent is rating them
+_save_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="image-save")
+
+
+# every jpeg starts with the SOI marker followed by the next marker's 0xFF
+JPEG_MAGIC = b"\xff\xd8\xff"
+
+
+def is_valid_image(file_stream, verify: bool = False) -> bool:
+    # sniff the magic bytes instead of parsing the image
     try:
-        initial_pos = file_stream.tell()
-        with Image.open(file_stream) as img:
-            img.verify()
-            if img.format.upper() not in ['JPEG', 'JPG']:
-                file_stream.seek(initial_pos)
-                return False
-        file_stream.seek(initial_pos)
-        return True
-    except (IOError, SyntaxError):
-        try:
+        file_stream.seek(0)
+        if file_stream.read(3) != JPEG_MAGIC:
+            return False
+
+        # optionally have PIL parse the whole file too (VERIFY_IMAGES)
+        if verify:
             file_stream.seek(0)
-        except:
-            pass
+            with Image.open(file_stream) as img:
+                img.verify()
+                return img.format == "JPEG"
+
+        return True
+    except (OSError, SyntaxError, ValueError):
         return False
+    finally:
+        file_stream.seek(0)
+
+
+# columns of a post in the public feed
+FEED_COLUMNS = (
+    Post.id, Post.recipe_title, Post.recipe_message, Post.recipe_image_url,
+    Post.recipe_video_url, Post.image_id, Post.rating, User.username, Post.date_posted,
+)
+
+
+# feed orderings by (sort_by, order): the sort column, its direction and the order by clause,
+# id breaks ties between posts with the same date or rating
+FEED_SORTS = {
+    ("date_posted", "desc"): (Post.date_posted, True, (Post.date_posted.desc(), Post.id.desc())),
+    ("date_posted", "asc"): (Post.date_posted, False, (Post.date_posted.asc(), Post.id.asc())),
+    ("rating", "desc"): (Post.rating, True, (Post.rating.desc(), Post.id.desc())),
+    ("rating", "asc"): (Post.rating, False, (Post.rating.asc(), Post.id.asc())),
+}
+
+
+def page_size_arg() -> int:
+    # page size from the query string, at most 100
+    page_size = min(int(request.args.get("page_size", 20)), 100)
+    return page_size if page_size >= 1 else 20
+
+
+def encode_cursor(value: date | float | None, post_id: int) -> str:
+    # opaque cursor pointing just past this post, (sort value, id)
+    return base64.urlsafe_b64encode(orjson.dumps([value, post_id])).decode()
+
+
+def decode_cursor(cursor: str, sort_column) -> tuple[date | float | None, int] | None:
+    # returns None for anything that isn't a cursor we produced
+    try:
+        value, post_id = orjson.loads(base64.urlsafe_b64decode(cursor))
+        if sort_column is Post.date_posted:
+            value = date.fromisoformat(value)
+        elif value is not None:
+            value = float(value)
+        return value, int(post_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def seek_after(sort_column, value: date | float | None, post_id: int, descending: bool):
+    # condition for the posts after (value, post_id) in (sort_column, id) order
+    # sqlite sorts nulls (unrated posts) before every value
+    if value is None:
+        same = sort_column.is_(None) & (Post.id < post_id if descending else Post.id > post_id)
+        return same if descending else or_(same, sort_column.is_not(None))
+
+    position = tuple_(sort_column, Post.id)
+    if not descending:
+        return position > (value, post_id)
+    if sort_column.expression.nullable:
+        # the nulls come last when descending
+        return or_(position < (value, post_id), sort_column.is_(None))
+    return position < (value, post_id)
+
+
+# image files never change, every upload gets a new uuid
+IMAGE_MAX_AGE = 30 * 24 * 60 * 60
+# posts can be revalidated cheaply with their etag after this
+POST_MAX_AGE = 30
+
+
+def cache_for(resp: Response, max_age: int, hidden: bool) -> Response:
+    # hidden posts and their images are only for their owner, keep them out of shared caches
+    resp.cache_control.no_cache = None
+    resp.cache_control.max_age = max_age
+    if hidden:
+        resp.cache_control.private = True
+    else:
+        resp.cache_control.public = True
+    return resp
+
+
+def post_exists(post_id: int) -> bool:
+    return db.session.scalar(select(Post.id).where(Post.id == post_id)) is not None
 
 
 @api_bp.get("/my-posts")
 def my_posts():
-    user: User | None = g.user
+    user: UserView | None = g.user
 
     # check if the user is authenticated
     if not user:
         return jsonify(error="Not authenticated"), HTTPStatus.UNAUTHORIZED
 
-    # get the posts by user id
-    posts: list[Post] = (
-        Post.query
-        .filter_by(user_id=user.id)
-        .order_by(Post.date_posted.desc())
-        .all()
+    # all of them, or one page at a time with ?cursor=(next_cursor|)?page_size=(page_size)
+    cursor = request.args.get("cursor")
+
+    # get the posts by user id, newest first
+    # plain rows of only the listed columns, the recipe text isn't part of this response
+    query = (
+        select(Post.id, Post.recipe_title, Post.image_id, Post.rating, Post.hidden, Post.date_posted)
+        .filter(Post.user_id == user.id)
+        .order_by(Post.date_posted.desc(), Post.id.desc())
     )
 
+    if cursor is None:
+        posts: list[Row] = db.session.execute(query).all()
+    else:
+        page_size = page_size_arg()
+        if cursor:
+            key = decode_cursor(cursor, Post.date_posted)
+            if key is None:
+                return jsonify(error="Invalid cursor"), HTTPStatus.BAD_REQUEST
+            query = query.filter(seek_after(Post.date_posted, *key, descending=True))
+
+        # fetch one extra row to know if there is a next page
+        posts: list[Row] = db.session.execute(query.limit(page_size + 1)).all()
+        last = posts[page_size - 1] if len(posts) > page_size else None
+        posts = posts[:page_size]
+
     data = [
         {
             "id": post.id,
             "title": post.recipe_title,
-            "image_url": (
-                url_for("api.get_image", image_id=post.image_id, _external=True)
-                if post.image_id else None
-            ),
+            "image_url": storage.image_url(post.image_id),
             "rating": post.rating,
             "hidden": post.hidden,
         }
         for post in posts
     ]
 
+    if cursor is not None:
+        next_cursor = encode_cursor(last.date_posted, last.id) if last else None
+        return jsonify(posts=data, next_cursor=next_cursor), HTTPStatus.OK
+
     return jsonify(posts=data), HTTPStatus.OK
 
 
 @api_bp.get("/posts/<int:post_id>")
 def get_post(post_id: int):
-    user: User | None = g.user
-    post: Post | None = db.session.get(Post, post_id)
+    user: UserView | None = g.user
+    # join the author's username into the same query, the response always includes it
+    post: Post | None = db.session.get(
+        Post, post_id, options=[joinedload(Post.user).load_only(User.username), undefer(Post.recipe_message)]
+    )
 
     if not post:
         return jsonify(error="Post not found"), HTTPStatus.NOT_FOUND
@@ -76,12 +190,9 @@ def get_post(post_id: int):
     if post.hidden and (not user or user.id != post.user_id):
         return jsonify(error="Post not found"), HTTPStatus.NOT_FOUND
 
-    image_url = (
-        url_for("api.get_image", image_id=post.image_id, _external=True)
-        if post.image_id else None
-    )
+    image_url = storage.image_url(post.image_id)
 
-    return jsonify(
+    resp = jsonify(
         id=post.id,
         user_id=post.user_id,
         username=post.user.username,
@@ -94,61 +205,91 @@ def get_post(post_id: int):
         image_url=image_url,
         rating=post.rating,
         hidden=post.hidden,
-        date_posted=post.date_posted.isoformat(),
-    ), HTTPStatus.OK
+        date_posted=post.date_posted,
+    )
+
+    # tag the body so clients revalidating an unchanged post get an empty 304
+    cache_for(resp, POST_MAX_AGE, post.hidden)
+    resp.add_etag()
+    return resp.make_conditional(request)
 
 
 @api_bp.get("/posts")
 def list_posts():
-    user: User | None = g.user
+    user: UserView | None = g.user
 
     # check if the user is authenticated
     if not user:
         return jsonify(error="Not authenticated"), HTTPStatus.UNAUTHORIZED
 
+    # answer repeated feed queries from the cache
+    body: bytes | None = Post.cached_feed(request.query_string)
+    if body is not None:
+        return Response(body, mimetype="application/json"), HTTPStatus.OK
+
     # example query:
     # use query builder to make this
     # https://api.keepcooking.recipes/posts?sort_by=(date_posted|rating)?order=(asc|desc)?page=(page_number)?page_size=(page_size)?min_rating=(0..5|Null)?max_rating=(0..5|Null)
+    # or page through the feed by cursor instead of page number (empty cursor for the first page):
+    # https://api.keepcooking.recipes/posts?cursor=(next_cursor|)?sort_by=(date_posted|rating)?order=(asc|desc)?page_size=(page_size)
 
-    sort_by = request.args.get("sort_by", "date_posted")
-    order = request.args.get("order", "desc").lower()
+    sort = FEED_SORTS.get((request.args.get("sort_by", "date_posted"), request.args.get("order", "desc").lower()))
+    if sort is None:
+        return jsonify(error="Invalid sort_by or order"), HTTPStatus.BAD_REQUEST
+    sort_column, descending, order_by = sort
     page = int(request.args.get("page", 1))
-    page_size = min(int(request.args.get("page_size", 20)), 100)
+    page_size = page_size_arg()
+    cursor = request.args.get("cursor")
 
     min_rating = request.args.get("min_rating")
     max_rating = request.args.get("max_rating")
 
-    # base query: visible posts only
-    query = (
-        Post.query
-        .join(User)
-        .filter(Post.hidden.is_(False))
-    )
+    # visible posts only
+    filters = [Post.hidden.is_(False)]
 
     # rating filters
     if min_rating is not None:
-        query = query.filter(Post.rating >= float(min_rating))
+        filters.append(Post.rating >= float(min_rating))
     if max_rating is not None:
-        query = query.filter(Post.rating <= float(max_rating))
+        filters.append(Post.rating <= float(max_rating))
 
-    # sort by rating or date posted
-    if sort_by == "rating":
-        sort_column = Post.rating
-    else:
-        sort_column = Post.date_posted
+    # base query
+    # selects plain rows of just the feed columns with the author joined in,
+    # no Post/User objects are built for a read-only listing
+    # sorted by rating or date posted, ascending or descending
+    query = (
+        select(*FEED_COLUMNS)
+        .join(User, Post.user_id == User.id)
+        .filter(*filters)
+        .order_by(*order_by)
+    )
 
-    # sort in ascending or descending order
-    if order == "asc":
-        query = query.order_by(asc(sort_column))
-    else:
-        query = query.order_by(desc(sort_column))
+    if cursor is None:
 
-    # paginate result
-    pagination = query.paginate(page=page, per_page=page_size, error_out=False)
+        # paginate result
+        # (flask-sqlalchemy's paginate only returns orm objects, so count and slice the rows here)
+        page = max(page, 1)
+        # count straight off the posts table with the same filters, no subquery and no join,
+        # so sqlite can answer it from the (hidden, ...) index
+        total = db.session.scalar(select(func.count(Post.id)).filter(*filters))
+        posts: list[Row] = db.session.execute(query.limit(page_size).offset((page - 1) * page_size)).all()
+    else:
+        # cursor pages seek past the last post of the previous page on (sort column, id),
+        # no COUNT and no OFFSET, so every page costs the same however deep it is
+        if cursor:
+            key = decode_cursor(cursor, sort_column)
+            if key is None:
+                return jsonify(error="Invalid cursor"), HTTPStatus.BAD_REQUEST
+            query = query.filter(seek_after(sort_column, *key, descending=descending))
+
+        # fetch one extra row to know if there is a next page
+        posts: list[Row] = db.session.execute(query.limit(page_size + 1)).all()
+        last = posts[page_size - 1] if len(posts) > page_size else None
+        posts = posts[:page_size]
 
     # format posts
     items = []
-    for post in pagination.items:
+    for post in posts:
         items.append(
             {
                 "id": post.id,
@@ -158,49 +299,67 @@ def list_posts():
                     "image_url": post.recipe_image_url,
                     "video_url": post.recipe_video_url,
                 },
-                "image_url": (
-                    url_for("api.get_image", image_id=post.image_id, _external=True)
-                    if post.image_id else None
-                ),
+                "image_url": storage.image_url(post.image_id),
                 "rating": post.rating,
-                "username": post.user.username,
-                "date_posted": post.date_posted.isoformat(),
+                "username": post.username,
+                "date_posted": post.date_posted,
             }
         )
 
-    # send the paginated result
-    return jsonify(
-        page=pagination.page,
-        page_size=page_size,
-        total_pages=pagination.pages,
-        total_items=pagination.total,
-        items=items,
-    ), HTTPStatus.OK
+    if cursor is not None:
+        # send the page and the cursor for the next one (null on the last page)
+        resp = jsonify(
+            page_size=page_size,
+            next_cursor=encode_cursor(last._mapping[sort_column], last.id) if last else None,
+            items=items,
+        )
+    else:
+        # send the paginated result
+        resp = jsonify(
+            page=page,
+            page_size=page_size,
+            total_pages=-(-total // page_size),
+            total_items=total,
+            items=items,
+        )
+
+    Post.cache_feed(request.query_string, resp.get_data())
+    return resp, HTTPStatus.OK
 
 
 @api_bp.delete("/posts/<int:post_id>")
 def delete_post(post_id: int):
-    user: User | None = g.user
+    user: UserView | None = g.user
 
     # check if the user is authenticated
     if not user:
         return jsonify(error="Not authenticated"), HTTPStatus.UNAUTHORIZED
 
-    # get the post fromt he post id
-    post: Post | None = db.session.get(Post, post_id)
-
-    # check if the post exists
-    if not post:
-        return jsonify(error="Post not found"), HTTPStatus.NOT_FOUND
-
-    # if the post is not owned by the user, they can't delete it
-    # unless they are the admin
-    if (post.user_id != user.id) and not user.admin:
+    # delete the post in one statement if the user is allowed to
+    # (the owner, or any post for the admin)
+    stmt = delete(Post).where(Post.id == post_id)
+    if not user.admin:
+        stmt = stmt.where(Post.user_id == user.id)
+    else:
+        # the snapshot can be stale on this worker, so the admin flag is read from the row
+        # in the same statement, a user who lost it can still only delete their own posts
+        is_admin = select(User.admin).where(User.id == user.id).scalar_subquery()
+        stmt = stmt.where(or_(Post.user_id == user.id, is_admin))
+    deleted = db.session.execute(stmt.returning(Post.image_id)).first()
+
+    # nothing deleted, find out whether the post exists to pick the error
+    if not deleted:
+        if not post_exists(post_id):
+            return jsonify(error="Post not found"), HTTPStatus.NOT_FOUND
+        # if the post is not owned by the user, they can't delete it
         return jsonify(error="Not authorized"), HTTPStatus.FORBIDDEN
 
-    # delete the element from the database
-    db.session.delete(post)
     db.session.commit()
+    Post.forget_image(deleted.image_id)
+    Post.forget_feed()
+
+    # a bulk delete skips the after_delete listener, remove the image here
+    storage.discard(deleted.image_id)
 
     # succesfully deleted
     return jsonify(message="Post deleted"), HTTPStatus.OK
@@ -208,43 +367,48 @@ def delete_post(post_id: int):
 
 @api_bp.post("/posts/<int:post_id>/publish")
 def publish_post(post_id: int):
-    user: User | None = g.user
+    user: UserView | None = g.user
 
     # check if the user is authenticated
     if not user:
         return jsonify(error="Not authenticated"), HTTPStatus.UNAUTHORIZED
 
-    # check if the post exists
-    post: Post | None = db.session.get(Post, post_id)
-    if not post:
-        return jsonify(error="Post not found"), HTTPStatus.NOT_FOUND
-
-    # not the correct user
-    if post.user_id != user.id:
+    # make the post visible and update the date posted to now,
+    # only if it's the user's post
+    # the database picks the date, the same clock as the column's server default
+    published = db.session.execute(
+        update(Post)
+        .where(Post.id == post_id, Post.user_id == user.id)
+        .values(hidden=False, date_posted=func.current_date())
+        .returning(Post.image_id)
+    ).first()
+
+    # nothing updated, the post doesn't exist or isn't theirs
+    if not published:
+        if not post_exists(post_id):
+            return jsonify(error="Post not found"), HTTPStatus.NOT_FOUND
         return jsonify(error="Not authorized"), HTTPStatus.FORBIDDEN
 
-    # make the post visible
-    post.hidden = False
-
-    # update the date posted to now
-    post.date_posted = date.today()
-
     # update the database
     db.session.commit()
+    Post.forget_image(published.image_id)
+    Post.forget_feed()
 
-    return jsonify(message="Post published", post_id=post.id), HTTPStatus.OK
+    return jsonify(message="Post published", post_id=post_id), HTTPStatus.OK
 
 
 @api_bp.post("/posts/<int:post_id>/generate-rating")
 def generate_rating(post_id: int):
-    user: User | None = g.user
+    user: UserView | None = g.user
 
     # check if the user is authenticated
     if not user:
         return jsonify(error="Not authenticated"), HTTPStatus.UNAUTHORIZED
 
-    # get the post based on the post id
-    post: Post | None = db.session.get(Post, post_id)
+    # get the columns of the post the rating needs, not the whole row
+    post: Row | None = db.session.execute(
+        select(Post.user_id, Post.recipe_title, Post.recipe_message).where(Post.id == post_id)
+    ).first()
 
     # check if the post exists
     if not post:
@@ -262,7 +426,7 @@ def generate_rating(post_id: int):
         return jsonify(error="No image uploaded"), HTTPStatus.BAD_REQUEST
 
     # check if the image is valid
-    if not is_valid_image(file.stream):
+    if not is_valid_image(file.stream, verify=current_app.config.get("VERIFY_IMAGES", False)):
         return jsonify(error="Invalid image format. Must be JPG/JPEG"), HTTPStatus.BAD_REQUEST
     
     # Get media type from file
@@ -270,95 +434,124 @@ def generate_rating(post_id: int):
 
     # create a uuid for the image
     image_id = str(uuid4())
-    filename = f"{image_id}.jpg"
-
-    # check if an image already exists
-    if post.image_id:
-        # delete the old image
-        folder = current_app.config["IMAGE_UPLOAD_FOLDER"]
-        path = Path(folder) / f"{post.image_id}.jpg"
-        try:
-            # remove the file
-            path.unlink()
-        except FileNotFoundError:
-            # ignore file not found error, it's already gone
-            pass
-
-    # set the new image id
-    post.image_id = image_id
+
+    # Format recipe as text for the AI agent
+    recipe_text = f"Recipe: {post.recipe_title}\n\nInstructions:\n{post.recipe_message}"
+
+    # end the read transaction before the agent call, nothing is written until it answers,
+    # so no transaction stays open for the whole model latency
+    db.session.rollback()
+
+    # Read file data
+    file.stream.seek(0)
+    image_data = file.stream.read()
+
+    # save the image while the agent rates it, the file has to be on disk
+    # before the post points at it but the write doesn't need to wait for the rating
+    saved = _save_pool.submit(storage.save, image_id, image_data)
 
     # generate a rating here
     try:
-        # Read file data and rewind stream for later saving
-        file.stream.seek(0)
-        image_data = file.stream.read()
-        file.stream.seek(0)
-        
-        # Format recipe as text for the AI agent
-        recipe_text = f"Recipe: {post.recipe_title}\n\nInstructions:\n{post.recipe_message}"
-        
         result = image_agent.run_sync([
             recipe_text,
             BinaryImage(image_data, media_type=media_type)
         ])
+        output: ImageOutput = result.output
     except Exception:
-        db.session.rollback()
-        return jsonify(error=f"Error processing query"), HTTPStatus.INTERNAL_SERVER_ERROR
+        output = None
 
-    output: ImageOutput = result.output
+    try:
+        saved.result()
+    except OSError:
+        storage.discard(image_id)
+        return jsonify(error="Error saving image"), HTTPStatus.INTERNAL_SERVER_ERROR
+
+    if output is None:
+        storage.discard(image_id)
+        return jsonify(error=f"Error processing query"), HTTPStatus.INTERNAL_SERVER_ERROR
 
     # check if it was a valid rating
     if not output.valid_image:
-        db.session.rollback()
+        storage.discard(image_id)
         return jsonify(error="Invalid image submitted. Please take another picture and try again."), HTTPStatus.BAD_REQUEST
 
-    # update the post's rating
-    post.rating = output.rating
-
-    # reward the user: 1 flame = 1 point, and maybe level up
-    level_up = user.apply_rating_reward(output.rating)
-
-    # create the image folder if it doesnt already exist
-    folder = Path(current_app.config["IMAGE_UPLOAD_FOLDER"])
-    folder.mkdir(exist_ok=True)
+    try:
+        # read the image being replaced in the same transaction as the update, an overlapping
+        # rating may have replaced it since the agent call started
+        # (sqlite fails the update rather than let another write land between the two)
+        old_image_id: str | None = db.session.scalar(select(Post.image_id).where(Post.id == post_id))
+
+        # set the new image id and the post's rating
+        updated = db.session.execute(
+            update(Post)
+            .where(Post.id == post_id)
+            .values(image_id=image_id, rating=output.rating)
+            .returning(Post.id)
+        ).first()
+
+        # the post was deleted while the agent was running
+        if not updated:
+            db.session.rollback()
+            storage.discard(image_id)
+            return jsonify(error="Post not found"), HTTPStatus.NOT_FOUND
+
+        # reward the user: 1 flame = 1 point, and maybe level up
+        points, level, level_up = User.apply_rating_reward(user.id, output.rating)
+
+        # add the changes
+        db.session.commit()
+    except Exception:
+        # nothing points at the new image if the write failed
+        db.session.rollback()
+        storage.discard(image_id)
+        raise
 
-    # save the image to the path
-    path = folder / filename
-    file.save(path)
+    Post.forget_image(old_image_id)
+    Post.forget_feed()
 
-    # add the changes
-    db.session.commit()
+    # delete the old image once nothing points at it anymore
+    storage.discard(old_image_id)
 
     # generate a url for the image
-    image_url = url_for("api.get_image", image_id=image_id, _external=True)
+    image_url = storage.image_url(image_id)
 
     # return the response, along with the model's reasoning
     return jsonify(
         message=output.response,
-        post_id=post.id,
+        post_id=post_id,
         image_url=image_url,
-        rating=post.rating,
-        user_points=user.points,
-        user_level=user.level,
+        rating=output.rating,
+        user_points=points,
+        user_level=level,
         level_up=level_up # boolean for if the user leveled up
     ), HTTPStatus.OK
 
 
 @api_bp.get("/images/<string:image_id>.jpg")
 def get_image(image_id: str):
-    user: User | None = g.user
+    user: UserView | None = g.user
 
-    # lookup the Post from the image id
-    post: Post | None = Post.query.filter_by(image_id=image_id).first()
+    # lookup the post's visibility and owner from the image id
+    post: Row | None = Post.image_access(image_id)
 
     # not found
     if not post:
-        return HTTPStatus.NOT_FOUND
+        return jsonify(error="Image not found"), HTTPStatus.NOT_FOUND
 
     # if the post is hidden and the user id doesnt match the post's user id, return NOT FOUND
     if post.hidden and (not user or user.id != post.user_id):
-        return HTTPStatus.NOT_FOUND
+        return jsonify(error="Image not found"), HTTPStatus.NOT_FOUND
+
+    # behind nginx, only answer with where the file is and let nginx send it
+    # so the worker isn't tied up for the whole download
+    accel = current_app.config.get("X_ACCEL_IMAGES")
+    if accel:
+        resp = Response(headers={"X-Accel-Redirect": f"{accel.rstrip('/')}/{image_id}.jpg"}, mimetype="image/jpeg")
+    else:
+        # else, serve the image like normal
+        resp = send_from_directory(storage.IMAGE_DIR, f"{image_id}.jpg")
 
-    # else, serve the image like normal
-    folder = current_app.config["IMAGE_UPLOAD_FOLDER"]
-    return send_from_directory(folder, f"{image_id}.jpg")
+    # the image behind an id never changes, browsers don't need to ask again
+    cache_for(resp, IMAGE_MAX_AGE, post.hidden)
+    resp.cache_control.immutable = True
+    return resp
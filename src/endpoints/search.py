@@ -1,38 +1,55 @@
 
 from http import HTTPStatus
-from flask import jsonify, request, g
-from datetime import date
+from hashlib import blake2b
+from threading import Lock
+from cachetools import TTLCache
+from flask import jsonify, g
 
 from src.mcp import search_agent, RecipeOutput
 from src.extensions import db
-from src.models import User, Post
-from .blueprint import api_bp
+from src.models import UserView, Post
+from .blueprint import api_bp, json_body
+
+
+# normalized query hash -> agent output, identical searches skip the llm for an hour
+_search_cache: TTLCache = TTLCache(maxsize=1_000, ttl=60 * 60)
+_search_cache_lock = Lock()
 
 
 @api_bp.post("/search")
 def search():
     # get the user
-    user: User | None = g.user
+    user: UserView | None = g.user
 
     # return if not authenticated
     if not user:
         return jsonify(error="Not authenticated"), HTTPStatus.UNAUTHORIZED
 
     # get the body and query parameter
-    body = request.get_json(silent=True) or {}
+    body = json_body()
+    if body is None:
+        return jsonify(error="Invalid JSON body"), HTTPStatus.BAD_REQUEST
     query = (body.get("query") or "").strip()
 
     if not query:
         return jsonify(error="Missing Query"), HTTPStatus.BAD_REQUEST
 
-    # run the agent synchronously based on the query
-    try:
-        result = search_agent.run_sync(query)
-    except Exception:
-        return jsonify(error="Error processing query"), HTTPStatus.INTERNAL_SERVER_ERROR
+    # reuse the recipe from an earlier identical search if there is one
+    key = blake2b(query.lower().encode(), digest_size=16).digest()
+    with _search_cache_lock:
+        output: RecipeOutput | None = _search_cache.get(key)
+
+    if output is None:
+        # run the agent synchronously based on the query
+        try:
+            result = search_agent.run_sync(query)
+        except Exception:
+            return jsonify(error="Error processing query"), HTTPStatus.INTERNAL_SERVER_ERROR
 
-    # get the output
-    output: RecipeOutput = result.output
+        # get the output
+        output = result.output
+        with _search_cache_lock:
+            _search_cache[key] = output
 
     # add the output as a post to the database
     post = Post(
@@ -42,7 +59,6 @@ def search():
         recipe_message=output.message,
         recipe_image_url=output.image_url,
         recipe_video_url=output.video_url,
-        date_posted=date.today()
     )
 
     # update the database
@@ -1,15 +1,54 @@
+import orjson
+from flask import Response
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import event
 from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateIndex, CreateTable
 from sqlalchemy.engine.interfaces import DBAPIConnection
 
 db: SQLAlchemy = SQLAlchemy()
 
+
+def create_schema():
+    # create any missing tables and indexes, including indexes added to a model after
+    # its table already exists (create_all would skip them)
+    # every gunicorn worker runs this at startup at the same time, so instead of checking
+    # first and then creating (which races), let sqlite skip what already exists
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            conn.execute(CreateTable(table, if_not_exists=True))
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    # encode and decode json with orjson
+    # types orjson doesn't support fall back to flask's default hook
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s: str | bytes, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs) -> Response:
+        # write the encoded bytes straight into the response, without a str round trip
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 @event.listens_for(Engine, "connect")
 def set_sqlite_pragmas(dbapi_conn: DBAPIConnection, conn_record):
     # run this function on database connect
     cur = dbapi_conn.cursor()
     # Enable write-ahead logging and normal synchronization for performance
     cur.execute("PRAGMA journal_mode=WAL;")
-    cur.execute("PRAGMA synchronous=NORMAL;")   
+    cur.execute("PRAGMA synchronous=NORMAL;")
+    # read pages through a 256MiB memory map and keep up to 64MiB of them cached per connection
+    cur.execute("PRAGMA mmap_size=268435456;")
+    cur.execute("PRAGMA cache_size=-65536;")
+    # sort and temp tables stay in memory
+    cur.execute("PRAGMA temp_store=MEMORY;")
+    # wait for a writer to finish instead of failing with "database is locked"
+    cur.execute("PRAGMA busy_timeout=5000;")
     cur.close()
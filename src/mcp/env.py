@@ -9,10 +9,14 @@ THEMEALDB_API_KEY = os.getenv("THEMEALDB_API_KEY", "1")
 THEMEALDB_PREMIUM = THEMEALDB_API_KEY != "1"
 THEMEALDB_VERSION = "v2" if THEMEALDB_PREMIUM else "v1"
 THEMEALDB = f"https://www.themealdb.com/api/json/{THEMEALDB_VERSION}/{THEMEALDB_API_KEY}"
+# seconds a single gemini request may take before it's abandoned,
+# so a hung model call can't hold a worker thread indefinitely
+AGENT_TIMEOUT = float(os.getenv("AGENT_TIMEOUT", "30"))
 
 # make sure the google api key is defined
 if not GOOGLE_API_KEY:
     raise EnvironmentError("No GOOGLE_API_KEY defined.")
 
-# Provider for Gemini API
+# Provider for Gemini API, shared by both agents so they use one client
+# and one connection pool instead of each model building its own
 provider = GoogleProvider(api_key=GOOGLE_API_KEY)
\ No newline at end of file
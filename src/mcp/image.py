@@ -2,9 +2,10 @@ from __future__ import annotations
 
 from pydantic_ai import Agent
 from pydantic_ai.models.google import GoogleModel
+from pydantic_ai.settings import ModelSettings
 from pydantic import BaseModel, Field, field_validator
 
-from .env import *
+from .env import AGENT_TIMEOUT, provider
 
 # system prompt for model
 IMAGE_SYSTEM_PROMPT = """
@@ -72,7 +73,8 @@ class ImageOutput(BaseModel):
 
 # search agent creation
 image_agent: Agent = Agent(
-    model=GoogleModel(model_name="gemini-2.5-flash"),
+    model=GoogleModel(model_name="gemini-2.5-flash", provider=provider),
     system_prompt=IMAGE_SYSTEM_PROMPT,
-    output_type=ImageOutput
+    output_type=ImageOutput,
+    model_settings=ModelSettings(timeout=AGENT_TIMEOUT),
 )
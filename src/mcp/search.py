@@ -2,12 +2,50 @@ from __future__ import annotations
 
 from pydantic_ai import Agent, Tool
 from pydantic_ai.models.google import GoogleModel
-from pydantic import BaseModel, Field
+from pydantic_ai.settings import ModelSettings
+from pydantic import BaseModel, Field, TypeAdapter
 
 from typing import Annotated
-import requests
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
+import orjson, requests
+from requests.adapters import HTTPAdapter
+
+from .env import THEMEALDB_PREMIUM, THEMEALDB, AGENT_TIMEOUT, provider
+
+# one session for every mealdb call, the agent usually searches and then looks up a few ids,
+# so the calls reuse pooled keep-alive connections instead of a new tls handshake each
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# parsed mealdb responses by (path, params), meal data barely changes
+# searches are kept for 10 minutes, meal details (looked up by exact id) for a day
+_mealdb_cache: TTLCache = TTLCache(maxsize=1_024, ttl=10 * 60)
+_meal_details_cache: TTLCache = TTLCache(maxsize=1_024, ttl=24 * 60 * 60)
+_mealdb_cache_lock = Lock()
+
+# runs the lookups of lookup_meal_details_by_ids side by side
+_lookup_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="mealdb")
+
+
+def _get_json(path: str, params: dict, cache: TTLCache = _mealdb_cache) -> dict:
+    key = (path, tuple(sorted(params.items())))
+    with _mealdb_cache_lock:
+        result: dict | None = cache.get(key)
+    if result is not None:
+        return result
+
+    # send the request to the mealdb api
+    request = _session.get(f"{THEMEALDB}{path}", params=params, timeout=5)
+    # throw error if status code is bad
+    request.raise_for_status()
+    # parse the json straight from the body bytes
+    result = orjson.loads(request.content)
 
-from .env import THEMEALDB_PREMIUM, THEMEALDB
+    with _mealdb_cache_lock:
+        cache[key] = result
+    return result
 
 # system prompt for model
 SEARCH_SYSTEM_PROMPT = """
@@ -22,7 +60,7 @@ TOOL USE
    - If they give one main ingredient, CALL search_meal_by_main_ingredient(ingredient).
    - If they give multiple ingredients AND search_meal_by_multiple_ingredients is available, CALL search_meal_by_multiple_ingredients(list_of_ingredients). Otherwise fall back to search_meal_by_main_ingredient on the strongest ingredient.
 3) From the candidates, pick the top 1-3 most relevant by matching cuisine, keywords (e.g., “spicy”, “vegan”), and prep method.
-4) For each chosen candidate, CALL lookup_meal_details_by_id(id) to get full details before answering.
+4) CALL lookup_meal_details_by_ids(list_of_ids) once with all chosen candidates to get their full details before answering (lookup_meal_details_by_id(id) for a single one).
 
 MATCHING & ADJUSTMENTS
 - If no exact match: pick the closest dish and adapt it. Clearly label changes under “Modifications”.
@@ -57,11 +95,33 @@ STYLE
 """
 
 
+# (ingredient, measure) keys of a mealdb meal, numbered 1 through 20
+_INGREDIENT_KEYS = tuple((f"strIngredient{i}", f"strMeasure{i}") for i in range(1, 21))
+
+
 class PartialMealResponse(BaseModel):
     meal_id: int = Field(...)
     meal_name: str = Field(...)
 
 
+# validates a whole search result list in one call instead of one model at a time
+_PARTIAL_MEALS = TypeAdapter(list[PartialMealResponse])
+
+
+def _search(path: str, params: dict) -> list[PartialMealResponse]:
+    # shared by the search tools, which only differ in endpoint and params
+    result: dict = _get_json(path, params)
+
+    # return nothing if no meals found
+    if "meals" not in result or not result["meals"]:
+        return []
+
+    # turn meals into PartialMealResponse objects
+    return _PARTIAL_MEALS.validate_python(
+        [{"meal_id": meal["idMeal"], "meal_name": meal["strMeal"]} for meal in result["meals"]]
+    )
+
+
 class FullMealResponse(BaseModel):
     meal_id: int = Field(...)
     meal_name: str = Field(...)
@@ -69,7 +129,7 @@ class FullMealResponse(BaseModel):
     instructions: str = Field(...)
     ingredients: list[tuple[str, str]] = Field(...)
     image_url: str
-    video: str
+    video_url: str
 
 
 class RecipeOutput(BaseModel):
@@ -87,29 +147,7 @@ def search_meal_by_name(
     along with their id's for finding full details later"""
 
     # send a request to the mealdb api to find a meal by its name
-    request = requests.get(f"{THEMEALDB}/search.php", params={"s": name}, timeout=5)
-    # throw error if status code is bad
-    request.raise_for_status()
-    # get the json
-    result: dict = request.json()
-
-    # return nothing if no meals found
-    if "meals" not in result or not result["meals"]:
-        return []
-    
-    # get meals list
-    meals: list[dict] = result["meals"]
-
-    # turn meals into PartialMealResponse objects
-    parsed_meals: list[PartialMealResponse] = [
-        PartialMealResponse(
-            meal_id=meal["idMeal"],
-            meal_name=meal["strMeal"]
-        )
-        for meal in meals
-    ]
-
-    return parsed_meals
+    return _search("/search.php", {"s": name})
 
 
 @Tool
@@ -120,29 +158,7 @@ def search_meal_by_main_ingredient(
     along with their id's for finding full details later"""
 
     # send a request to the mealdb api to find a meal by its main ingredient
-    request = requests.get(f"{THEMEALDB}/filter.php", params={"i": ingredient}, timeout=5)
-    # throw error if status code is bad
-    request.raise_for_status()
-    # get the json
-    result: dict = request.json()
-
-    # return nothing if no meals found
-    if "meals" not in result or not result["meals"]:
-        return []
-    
-    # get meals list
-    meals: list[dict] = result["meals"]
-
-    # turn meals into PartialMealResponse objects
-    parsed_meals: list[PartialMealResponse] = [
-        PartialMealResponse(
-            meal_id=meal["idMeal"],
-            meal_name=meal["strMeal"]
-        )
-        for meal in meals
-    ]
-
-    return parsed_meals
+    return _search("/filter.php", {"i": ingredient})
 
 
 @Tool
@@ -153,49 +169,16 @@ def search_meal_by_multiple_ingredients(
     along with their id's for finding full details later"""
 
     # send a request to the mealdb api to find a meal by multiple ingredients in it
-    request = requests.get(f"{THEMEALDB}/filter.php", params={"i": ",".join(ingredients)}, timeout=5)
-    # throw error if status code is bad
-    request.raise_for_status()
-    # get the json
-    result: dict = request.json()
-
-    # return nothing if no meals found
-    if "meals" not in result or not result["meals"]:
-        return []
-    
-    # get meals list
-    meals: list[dict] = result["meals"]
-
-    # turn meals into PartialMealResponse objects
-    parsed_meals: list[PartialMealResponse] = [
-        PartialMealResponse(
-            meal_id=meal["idMeal"],
-            meal_name=meal["strMeal"]
-        )
-        for meal in meals
-    ]
-
-    return parsed_meals
-
+    return _search("/filter.php", {"i": ",".join(ingredients)})
 
-@Tool
-def lookup_meal_details_by_id(
-    id: Annotated[int, "Meal id, must match exactly"]
-) -> FullMealResponse | None:
-    """Takes in the exact id of the meal and returns its full details,
-     including the meal name, type, instructions, ingredients (along with serving sizes),
-     image url, and youtube video link"""
 
+def _meal_details(id: int) -> FullMealResponse | None:
     # send a request to the mealdb api to lookup a meal by its id
-    request = requests.get(f"{THEMEALDB}/lookup.php", params={"i": id}, timeout=5)
-    # throw error if status code is bad
-    request.raise_for_status()
-    # get the json
-    result: dict = request.json()
+    result: dict = _get_json("/lookup.php", {"i": id}, cache=_meal_details_cache)
 
     # return nothing if no meals found
     if "meals" not in result or not result["meals"]:
-        return []
+        return None
 
     # get meals list
     meals: list[dict] = result["meals"]
@@ -211,14 +194,15 @@ def lookup_meal_details_by_id(
     ingredients: list[tuple[str, str]] = []
 
     # get each ingredient and its corresponding measure
-    for i in range(1, 21):
-        ingredient = meal.get(f"strIngredient{i}")
-        measure = meal.get(f"strMeasure{i}")
-        
+    get = meal.get
+    for ingredient_key, measure_key in _INGREDIENT_KEYS:
+        ingredient = get(ingredient_key)
+        measure = get(measure_key)
+
         # if theyre empty or dont exist, skip it
         if not ingredient or not measure:
             continue
-            
+
         # if they do, package it in a tuple
         ingredients.append((ingredient, measure))
 
@@ -234,13 +218,39 @@ def lookup_meal_details_by_id(
         )
 
 
+@Tool
+def lookup_meal_details_by_id(
+    id: Annotated[int, "Meal id, must match exactly"]
+) -> FullMealResponse | None:
+    """Takes in the exact id of the meal and returns its full details,
+     including the meal name, type, instructions, ingredients (along with serving sizes),
+     image url, and youtube video link"""
+
+    return _meal_details(id)
+
+
+@Tool
+def lookup_meal_details_by_ids(
+    ids: Annotated[list[int], "Meal ids, must match exactly, at most 8 per call"]
+) -> list[FullMealResponse]:
+    """Takes in the exact ids of up to 8 meals and returns their full details in one call,
+     each including the meal name, type, instructions, ingredients (along with serving sizes),
+     image url, and youtube video link. Meals that aren't found are left out,
+     ids past the 8th are ignored, look them up in another call"""
+
+    # look the meals up at the same time instead of one round trip after another
+    meals = _lookup_pool.map(_meal_details, ids[:8])
+    return [meal for meal in meals if meal is not None]
+
+
 # search agent creation
 search_agent: Agent = Agent(
-    model=GoogleModel(model_name="gemini-2.5-flash"),
+    model=GoogleModel(model_name="gemini-2.5-flash", provider=provider),
     system_prompt=SEARCH_SYSTEM_PROMPT,
     output_type=RecipeOutput,
+    model_settings=ModelSettings(timeout=AGENT_TIMEOUT),
     # If the user does not specify a premium key,
     # the search_meal_by_multiple_ingredients function is not available
-    tools=[search_meal_by_name, search_meal_by_main_ingredient,search_meal_by_multiple_ingredients ,lookup_meal_details_by_id] 
-    if THEMEALDB_PREMIUM else [search_meal_by_name, search_meal_by_main_ingredient, lookup_meal_details_by_id]
+    tools=[search_meal_by_name, search_meal_by_main_ingredient,search_meal_by_multiple_ingredients ,lookup_meal_details_by_id, lookup_meal_details_by_ids] 
+    if THEMEALDB_PREMIUM else [search_meal_by_name, search_meal_by_main_ingredient, lookup_meal_details_by_id, lookup_meal_details_by_ids]
 )
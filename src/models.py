@@ -1,21 +1,60 @@
 from __future__ import annotations
+import os, time, secrets
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError, VerificationError, InvalidHashError
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm import Mapped, Session, mapped_column, relationship
 from datetime import date, datetime
 from sqlalchemy import (
     String, Text, Integer, Boolean, ForeignKey, Date, Float,
-    DateTime, func, event, case, select, Connection, Table
+    DateTime, Index, Row, func, event, case, select, update, delete, bindparam, Connection, Table
 )
 
-from flask import current_app
-from pathlib import Path
+from flask import Flask, current_app
+from threading import Lock
+from typing import NamedTuple
+from cachetools import TTLCache
 
-from src.auth import UserRegistration
+from src.auth import Auth, UserRegistration
+from src import storage
 from src.extensions import db
 
 ph = PasswordHasher(time_cost=3, memory_cost=64_000, parallelism=2)
 
+# bounded pool for argon2 work, caps how many hashes run at once across all requests
+# argon2 releases the GIL, so the workers hash in parallel
+_hash_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="argon2")
+
+
+class UserView(NamedTuple):
+    # read-only snapshot of a user row, safe to share between requests
+    id: int
+    username: str
+    email: str
+    admin: bool
+    points: int
+    level: int
+
+
+class Credentials(NamedTuple):
+    # what a login needs from the user row
+    id: int
+    password: str
+
+
+# hash of a random password that unknown usernames are verified against
+_DUMMY_HASH = ph.hash(secrets.token_urlsafe(16))
+
+
+# uid -> UserView, so authenticated requests don't hit the database for the user row
+# security trade-off: the cache is per worker, a commit only clears it on its own worker,
+# so for up to the ttl other workers still accept a removed user's access token and see
+# their old admin flag; kept short for that, and admin actions re-check the row itself
+_user_cache: TTLCache = TTLCache(maxsize=10_000, ttl=5)
+_user_cache_lock = Lock()
+
+
 class User(db.Model):
     __tablename__ = "auth"
 
@@ -39,13 +78,18 @@ class User(db.Model):
         cascade="all, delete-orphan"
     )
 
+    refresh_tokens: Mapped[list[RefreshToken]] = relationship(
+        back_populates="user",
+        cascade="all, delete-orphan"
+    )
+
     @staticmethod
     def create(user: UserRegistration) -> User:
         # create a new user, hashing + salting the plaintext password
         user = User(
             username=user.username,
             email=user.email,
-            password=ph.hash(user.password),
+            password=_hash_pool.submit(ph.hash, user.password).result(),
         )
         # add the user to the database
         db.session.add(user)
@@ -53,45 +97,220 @@ class User(db.Model):
         return user
 
     @staticmethod
-    def by_username(username: str) -> User | None:
-        # find the user by the username
-        return User.query.filter_by(username=username).first()
+    def view(uid: int) -> UserView | None:
+        # return the cached snapshot of the user if it's still fresh
+        with _user_cache_lock:
+            view = _user_cache.get(uid)
+        if view:
+            return view
+
+        # otherwise load the user from the database and cache it
+        user = db.session.get(User, uid)
+        if not user:
+            return None
+
+        view = user.snapshot()
+        with _user_cache_lock:
+            _user_cache[uid] = view
+        return view
+
+    @staticmethod
+    def forget(uid: int) -> None:
+        # drop the cached snapshot, done on commit for every user row written (see below)
+        with _user_cache_lock:
+            _user_cache.pop(uid, None)
+
+    def snapshot(self) -> UserView:
+        return UserView(
+            id=self.id,
+            username=self.username,
+            email=self.email,
+            admin=bool(self.admin),
+            points=self.points or 0,
+            level=self.level or 0,
+        )
+
+    @staticmethod
+    def credentials(username: str) -> Credentials | None:
+        # return the id and password hash for the username, reusing the prebuilt statement
+        # not cached: a removed account must stop logging in on every worker at once,
+        # and the indexed lookup is nothing next to the argon2 verify
+        row = db.session.execute(_CREDENTIALS, {"username": username}).first()
+        return Credentials(*row) if row else None
 
-    def verify_and_maybe_rehash(self, password_plain: str) -> bool:
-        # try to verify the password based on the plaintext password
+    @staticmethod
+    def verify_password(password_hash: str, password_plain: str) -> bool:
+        # verify the plaintext password against the hash on the hash pool
         try:
-            ph.verify(self.password, password_plain)
+            return _hash_pool.submit(ph.verify, password_hash, password_plain).result()
         except (VerifyMismatchError, VerificationError, InvalidHashError):
             # if it fails to verify, return false
             return False
 
+    @staticmethod
+    def authenticate(username: str, password_plain: str) -> int | None:
+        # return the user id if the password is correct for the username
+        creds = User.credentials(username)
+
+        # unknown usernames are still checked against a dummy hash,
+        # so a failed login takes as long whether or not the username exists
+        if not creds:
+            User.verify_password(_DUMMY_HASH, password_plain)
+            return None
+
+        if not User.verify_password(creds.password, password_plain):
+            return None
+
         # if it's valid and needs to be rehashed, rehash it and commit those changes
-        if ph.check_needs_rehash(self.password):
-            self.password = ph.hash(password_plain)
-            db.session.commit()
+        # in the background, the login doesn't wait for the new hash
+        if ph.check_needs_rehash(creds.password):
+            _hash_pool.submit(User.rehash, current_app._get_current_object(), creds, password_plain)
 
-        # return true, verified
-        return True
+        # return the id, verified
+        return creds.id
+
+    @staticmethod
+    def rehash(app: Flask, creds: Credentials, password_plain: str) -> None:
+        # runs on the hash pool, outside of any request
+        new_hash = ph.hash(password_plain)
+        with app.app_context():
+            try:
+                # only replace the hash that was verified, in case the password changed since
+                db.session.execute(
+                    update(User)
+                    .where(User.id == creds.id, User.password == creds.password)
+                    .values(password=new_hash)
+                )
+                _changed_user(db.session, creds.id)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Failed to rehash password for user %s", creds.id)
 
     @staticmethod
     def level_for_points(points: int) -> int:
         # make a new level every 20 points
         return points // 20
 
-    def apply_rating_reward(self, rating: int) -> bool:
-        # safeguard
-        rating = int(rating)
-        if rating < 1:
-            rating = 1
-        if rating > 5:
-            rating = 5
+    @staticmethod
+    def apply_rating_reward(uid: int, rating: int) -> tuple[int, int, bool]:
+        # safeguard, clamp to 1..5
+        rating = max(1, min(5, int(rating)))
+
+        # add the points in the UPDATE itself and read the totals back with RETURNING,
+        # so two ratings finishing at once can't overwrite each other's points
+        points = func.coalesce(User.points, 0) + rating
+        new_points, new_level = db.session.execute(
+            update(User)
+            .where(User.id == uid)
+            .values(points=points, level=User.level_for_points(points))
+            .returning(User.points, User.level)
+            .execution_options(synchronize_session="fetch")
+        ).one()
+        _changed_user(db.session, uid)
+
+        # return the new totals, and true for level up
+        return new_points, new_level, new_level != User.level_for_points(new_points - rating)
+
+
+# snapshots are dropped once a change to the user row is committed, not at flush,
+# so another request can't cache the old row again before the commit lands.
+# new users are included too, sqlite can reuse the id of a deleted user
+def _changed_user(session: Session, uid: int) -> None:
+    # also called directly for bulk UPDATEs, which don't go through the flush
+    session.info.setdefault("changed_users", set()).add(uid)
+
+
+@event.listens_for(Session, "after_flush")
+def collect_changed_users(session: Session, flush_context):
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, User):
+            _changed_user(session, obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def forget_changed_users(session: Session):
+    for uid in session.info.pop("changed_users", ()):
+        User.forget(uid)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_changed_users(session: Session):
+    session.info.pop("changed_users", None)
+
+
+# built once so every login reuses the same cached, compiled statement
+# username is unique and indexed, so this is a single index lookup
+_CREDENTIALS = select(User.id, User.password).where(User.username == bindparam("username"))
+
 
-        self.points = (self.points or 0) + rating
-        prev_level = self.level
-        self.level = self.level_for_points(self.points)
+class RefreshToken(db.Model):
+    __tablename__ = "refresh_tokens"
 
-        # return true for level up
-        return self.level != prev_level
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+
+    # map the parent user and userid
+    user_id: Mapped[int] = mapped_column(ForeignKey("auth.id"), nullable=False, index=True)
+    user: Mapped[User] = relationship(back_populates="refresh_tokens")
+
+    # sha256 of the token, the token itself only lives in the client's cookie
+    token_hash: Mapped[str] = mapped_column(String(64), nullable=False, unique=True, index=True)
+
+    # unix time of expiry
+    expires_at: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    @staticmethod
+    def issue(user_id: int) -> str:
+        token, token_hash, expires_at = Auth.issue_refresh()
+
+        # drop the user's expired tokens so they don't pile up
+        db.session.execute(
+            delete(RefreshToken)
+            .where(RefreshToken.user_id == user_id, RefreshToken.expires_at <= int(time.time()))
+        )
+
+        # store the new token's hash
+        db.session.add(RefreshToken(user_id=user_id, token_hash=token_hash, expires_at=expires_at))
+        db.session.commit()
+        return token
+
+    @staticmethod
+    def user_for(token: str | None) -> int | None:
+        # find the user id of a valid, unexpired refresh token
+        if not token:
+            return None
+
+        # joined to the users table: sqlite doesn't enforce the foreign key and reuses ids,
+        # so a token left behind by a removed account must not resolve to whoever gets its id next
+        row = db.session.execute(
+            select(RefreshToken.user_id)
+            .join(User, User.id == RefreshToken.user_id)
+            .where(RefreshToken.token_hash == Auth.hash_refresh(token), RefreshToken.expires_at > int(time.time()))
+        ).first()
+        return row.user_id if row else None
+
+    @staticmethod
+    def revoke(token: str | None) -> None:
+        # delete the refresh token so it can't be used again
+        if not token:
+            return
+
+        db.session.execute(delete(RefreshToken).where(RefreshToken.token_hash == Auth.hash_refresh(token)))
+        db.session.commit()
+
+
+# encoded feed pages by query string, the public feed is the same for every user
+# cleared whenever a post enters, leaves or changes in the feed (publish, delete, rating),
+# other workers catch up within the ttl
+_feed_cache: TTLCache = TTLCache(maxsize=256, ttl=30)
+_feed_cache_lock = Lock()
+
+# (hidden, user_id) of the post behind an image id, a feed page asks for every thumbnail
+# at once and each one only needs these two columns to decide access
+# entries are dropped when a post is deleted, published or its image replaced,
+# other workers catch up within the ttl
+_image_access: TTLCache = TTLCache(maxsize=4_096, ttl=60)
+_image_access_lock = Lock()
 
 
 class Post(db.Model):
@@ -108,7 +327,9 @@ class Post(db.Model):
 
     # Flattened RecipeOutput fields
     recipe_title: Mapped[str] = mapped_column(String(255), nullable=False)
-    recipe_message: Mapped[str] = mapped_column(Text, nullable=False)
+    # the recipe text is the bulk of a row, only loaded from a Post object when asked for
+    # (get_post undefers it, the listings select their columns directly)
+    recipe_message: Mapped[str] = mapped_column(Text, nullable=False, deferred=True)
     recipe_image_url: Mapped[str | None] = mapped_column(Text, nullable=True)
     recipe_video_url: Mapped[str | None] = mapped_column(Text, nullable=True)
 
@@ -125,18 +346,79 @@ class Post(db.Model):
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
     updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
 
+    @staticmethod
+    def cached_feed(query: bytes) -> bytes | None:
+        with _feed_cache_lock:
+            return _feed_cache.get(query)
+
+    @staticmethod
+    def cache_feed(query: bytes, body: bytes) -> None:
+        with _feed_cache_lock:
+            _feed_cache[query] = body
+
+    @staticmethod
+    def forget_feed() -> None:
+        with _feed_cache_lock:
+            _feed_cache.clear()
+
+    @staticmethod
+    def image_access(image_id: str) -> Row | None:
+        with _image_access_lock:
+            access: Row | None = _image_access.get(image_id)
+        if access is not None:
+            return access
+
+        access = db.session.execute(
+            select(Post.hidden, Post.user_id).where(Post.image_id == image_id)
+        ).first()
+
+        # misses aren't cached, the id may belong to an upload that is about to commit
+        if access is not None:
+            with _image_access_lock:
+                _image_access[image_id] = access
+        return access
+
+    @staticmethod
+    def forget_image(image_id: str | None) -> None:
+        if image_id:
+            with _image_access_lock:
+                _image_access.pop(image_id, None)
+
+
+# the public feed filters on hidden and walks (date_posted, id) newest first,
+# this index serves the cursor pages in list_posts without a sort or a full scan
+Index("ix_posts_feed", Post.hidden, Post.date_posted.desc(), Post.id.desc())
+
+# same for the rating sort, (rating, id) in either direction is a range scan
+Index("ix_posts_feed_rating", Post.hidden, Post.rating.desc(), Post.id.desc())
+
+# my_posts lists one user's posts newest first (id breaks ties), served straight from this index
+Index("ix_posts_user_date", Post.user_id, Post.date_posted.desc(), Post.id.desc())
 
 
 @event.listens_for(Post, "after_delete")
 def delete_post_image(mapper, connection, target: Post):
-    # remove image file if exists
-    if target.image_id:
-        folder = current_app.config["IMAGE_UPLOAD_FOLDER"]
-        path = Path(folder) / f"{target.image_id}.jpg"
-        try:
-            # remove the file
-            path.unlink()
-        except FileNotFoundError:
-            # ignore file not found error, it's already gone
-            pass
+    # once the delete is committed, drop the post from the feed and image caches
+    # and remove its image file if exists (a rolled back delete keeps both)
+    # orm deletes only, e.g. the cascade of an account removal, bulk deletes clean up themselves
+    Session.object_session(target).info.setdefault("deleted_posts", set()).add(target.image_id)
+
+
+@event.listens_for(Session, "after_commit")
+def discard_deleted_images(session: Session):
+    image_ids = session.info.pop("deleted_posts", None)
+    if not image_ids:
+        return
+
+    Post.forget_feed()
+    for image_id in image_ids:
+        if image_id:
+            Post.forget_image(image_id)
+            # queued for the background remover, the commit doesn't wait on the filesystem
+            storage.discard(image_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def keep_deleted_images(session: Session):
+    session.info.pop("deleted_posts", None)
 
@@ -0,0 +1,77 @@
+import os
+from queue import Queue
+from threading import Lock, Thread
+from flask import Flask, url_for
+
+# folder uploaded images are stored in, resolved once when the app is created
+# so requests don't look it up in the app config and rebuild the path every time
+IMAGE_DIR: str = "/app/src/data/images"
+
+# external url of the image route up to the image id, built on first use
+_image_url_prefix: str | None = None
+
+# paths of replaced or deleted images, unlinked by a background thread
+# so requests don't wait on the filesystem after they commit
+_discarded: Queue[str] = Queue()
+_remover: Thread | None = None
+_remover_lock = Lock()
+
+
+def init_app(app: Flask):
+    global IMAGE_DIR, _image_url_prefix
+    _image_url_prefix = None
+    IMAGE_DIR = os.path.realpath(app.config["IMAGE_UPLOAD_FOLDER"])
+    # create the image folder once instead of on every upload
+    os.makedirs(IMAGE_DIR, exist_ok=True)
+
+
+def image_path(image_id: str) -> str:
+    # plain string paths, a Path object per upload buys nothing here
+    return os.path.join(IMAGE_DIR, f"{image_id}.jpg")
+
+
+def save(image_id: str, data: bytes):
+    # write the whole upload in one go, the folder is created at startup
+    with open(image_path(image_id), "wb") as f:
+        f.write(data)
+
+
+def image_url(image_id: str | None) -> str | None:
+    # image urls only differ by the id, so route the url once and format the rest
+    global _image_url_prefix
+    if not image_id:
+        return None
+    if _image_url_prefix is None:
+        _image_url_prefix = url_for("api.get_image", image_id="_", _external=True).removesuffix("_.jpg")
+    return f"{_image_url_prefix}{image_id}.jpg"
+
+
+def _remove_discarded():
+    while True:
+        path = _discarded.get()
+        try:
+            os.unlink(path)
+        except OSError:
+            # already gone, don't check first
+            pass
+        finally:
+            _discarded.task_done()
+
+
+def discard(image_id: str | None):
+    # queue the image file for removal, call once nothing points at it anymore
+    global _remover
+    if not image_id:
+        return
+    _discarded.put(image_path(image_id))
+    # started on first use so every gunicorn worker gets its own thread
+    if _remover is None or not _remover.is_alive():
+        with _remover_lock:
+            if _remover is None or not _remover.is_alive():
+                _remover = Thread(target=_remove_discarded, name="image-remover", daemon=True)
+                _remover.start()
+
+
+def wait_for_discarded():
+    # block until every queued image is removed (tests)
+    _discarded.join()
@@ -1,39 +1,107 @@
-import os
+import os, importlib
 import pytest
-from src.extensions import db
+from http import HTTPStatus
 from flask.testing import FlaskClient
 from flask import Flask
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+# configure the testing environment
+# set before anything imports src, Auth reads its algorithm and key once on import,
+# and the test modules import src.models while they're collected
+# tokens are signed with the cheapest hmac, the tests don't depend on the algorithm
+os.environ.setdefault("JWT_SECRET", "test-secret-" + "x" * 32) # pyjwt warns about hmac keys under 32 bytes
+os.environ.setdefault("JWT_ALGORITHM", "HS256")
+os.environ.setdefault("COOKIE_SECURE", "false")
+os.environ.setdefault("ACCESS_TTL_HOURS", "24")
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+os.environ.setdefault("THEMEALDB_API_KEY", "1")
+
 
 @pytest.fixture(scope="session")
-def app():
-    # configure the testing environment
-    os.environ.setdefault("JWT_SECRET", "test-secret")
-    os.environ.setdefault("COOKIE_SECURE", "false")
-    os.environ.setdefault("ACCESS_TTL_HOURS", "24")
-    os.environ.setdefault("GOOGLE_API_KEY", "test-key")
-    os.environ.setdefault("THEMEALDB_API_KEY", "1")
-
-    from src.app import app as flask_app
-
-    # Set database to be in memory,
-    # and set TESTING variable to true, if needed
-    flask_app.config.update(
-        TESTING=True,
-        SQLALCHEMY_DATABASE_URI="sqlite:///:memory:",
-    )
-
-    # initialize the database
-    db.init_app(flask_app)
-
-    # empty and create the database
-    with flask_app.app_context():
-        db.drop_all()
-        db.create_all()
+def app(tmp_path_factory: pytest.TempPathFactory):
+    from src.app import create_app
+
+    # a fresh database file and image folder in a temp directory,
+    # so every test session (and every xdist worker) gets its own
+    # the config is passed in before the database is initialized, create_app builds the tables
+    data = tmp_path_factory.mktemp("data")
+    flask_app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{data / 'test.db'}",
+        "IMAGE_UPLOAD_FOLDER": str(data / "images"),
+    })
 
     return flask_app
 
 
+@pytest.fixture(autouse=True)
+def rollback_after_test(app: Flask):
+    # the app and its tables are built once per session, each test runs inside one
+    # outer transaction that is rolled back afterwards, the endpoints' commits only
+    # release savepoints inside it
+    from src.extensions import db
+
+    with app.app_context():
+        connection = db.engine.connect()
+    # pysqlite starts transactions lazily, begin explicitly so the savepoints nest inside it
+    sqlite_connection = connection.connection.driver_connection
+    sqlite_connection.isolation_level = None
+    transaction = connection.begin()
+    connection.exec_driver_sql("BEGIN")
+
+    app_session = db.session
+    db.session = scoped_session(sessionmaker(bind=connection, join_transaction_mode="create_savepoint"))
+    try:
+        yield
+    finally:
+        db.session.remove()
+        db.session = app_session
+        transaction.rollback()
+        sqlite_connection.isolation_level = ""
+        connection.close()
+        clear_app_caches()
+
+
+def clear_app_caches():
+    # cached rows of rolled back data would outlive the rollback (and sqlite reuses ids)
+    from src import models
+    from src.mcp import search as mealdb
+    # the package re-exports the search view under the module's name
+    search = importlib.import_module("src.endpoints.search")
+
+    for cache in (
+        models._user_cache, models._feed_cache, models._image_access,
+        search._search_cache, mealdb._mealdb_cache, mealdb._meal_details_cache,
+    ):
+        cache.clear()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def cheap_password_hashing():
+    # signups and logins hash with the cheapest argon2 settings instead of the production ones,
+    # still real argon2 hashes, only the cost of each one is gone
+    from argon2 import PasswordHasher
+    from src import models
+
+    mp = pytest.MonkeyPatch()
+    ph = PasswordHasher(time_cost=1, memory_cost=8, parallelism=1)
+    mp.setattr(models, "ph", ph)
+    # unknown usernames are checked against this one
+    mp.setattr(models, "_DUMMY_HASH", ph.hash("dummy"))
+    yield
+    mp.undo()
+
+
 @pytest.fixture()
 def client(app: Flask) -> FlaskClient:
     # test the client
     return app.test_client()
+
+
+@pytest.fixture(scope="module")
+def registered_user(app: Flask, request: pytest.FixtureRequest) -> dict:
+    # one account per test module, for tests that only need an existing user to log in as
+    name = f"user-{request.module.__name__.rsplit('.', 1)[-1]}"
+    user = {"username": name, "email": f"{name}@example.com", "password": "Testing123!)@"}
+    assert app.test_client().post("/api/signup", json=user).status_code == HTTPStatus.CREATED
+    return user
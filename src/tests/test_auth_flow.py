@@ -1,7 +1,12 @@
+import os, jwt, orjson
 import pytest
 from http import HTTPStatus
-from flask import Response
+from flask import Flask, Response
 from flask.testing import FlaskClient
+from sqlalchemy import delete
+
+from src.extensions import db
+from src.models import User
 
 def test_signup_sets_cookie_and_me_is_authenticated(client: FlaskClient):
     # create a new user
@@ -27,6 +32,14 @@ def test_signup_sets_cookie_and_me_is_authenticated(client: FlaskClient):
     assert data["email"] == "alice@example.com"
 
 
+def test_tokens_are_signed_with_the_test_secret(client: FlaskClient):
+    # the conftest's JWT_ALGORITHM and JWT_SECRET reach Auth, not a random key
+    client.post("/api/signup", json={"username": "bella", "email": "bella@example.com", "password": "Testing123!)@"})
+    token = client.get_cookie("access_token").value
+    assert jwt.get_unverified_header(token)["alg"] == "HS256"
+    assert jwt.decode(token, os.environ["JWT_SECRET"], algorithms=["HS256"])["sub"]
+
+
 def test_duplicate_username_conflict(client: FlaskClient):
     # create a new user
     resp1 = client.post("/api/signup", json={"username": "bob", "email": "b1@example.com", "password": "Testing123!)@"})
@@ -50,9 +63,9 @@ def test_me_unauthenticated_when_no_cookie(client: FlaskClient):
     assert resp.get_json()["authenticated"] is False
 
 
-def test_logout_clears_cookie_and_me_is_false(client: FlaskClient):
-    # create a new user
-    client.post("/api/signup", json={"username": "erin", "email": "erin@example.com", "password": "Testing123!)@"})
+def test_logout_clears_cookie_and_me_is_false(client: FlaskClient, registered_user: dict):
+    # login as an existing user
+    client.post("/api/login", json={"username": registered_user["username"], "password": registered_user["password"]})
 
     # make sure the user's authenticated
     assert client.get("/api/me").get_json()["authenticated"] is True
@@ -66,38 +79,59 @@ def test_logout_clears_cookie_and_me_is_false(client: FlaskClient):
     assert client.get("/api/me").get_json()["authenticated"] is False
 
 
-def test_login_success_and_me(client: FlaskClient):
+def test_missing_access_token_is_renewed_from_refresh_token(client: FlaskClient):
+    # create a new user
+    client.post("/api/signup", json={"username": "frank", "email": "frank@example.com", "password": "Testing123!)@"})
+
+    # drop the jwt token, as if it expired, leaving only the refresh token
+    client.delete_cookie("access_token")
+
+    # the user should still be authenticated, and get a new jwt token
+    resp: Response = client.get("/api/me")
+    assert resp.get_json()["authenticated"] is True
+    assert "access_token=" in resp.headers.get("Set-Cookie", "")
+
+
+def test_refresh_issues_access_until_logout(client: FlaskClient):
     # create a new user
-    client.post("/api/signup", json={"username": "carol", "email": "carol@example.com", "password": "Testing123!)@"})
+    client.post("/api/signup", json={"username": "grace", "email": "grace@example.com", "password": "Testing123!)@"})
 
-    # logout to clear cookie
+    # the refresh token should issue a new jwt token
+    resp: Response = client.post("/api/refresh")
+    assert resp.status_code == HTTPStatus.OK
+    assert "access_token=" in resp.headers.get("Set-Cookie", "")
+
+    # logout to revoke the refresh token
+    refresh_token = client.get_cookie("refresh_token").value
     client.post("/api/logout")
 
+    # the revoked refresh token should not work anymore
+    client.set_cookie("refresh_token", refresh_token)
+    resp: Response = client.post("/api/refresh")
+    assert resp.status_code == HTTPStatus.UNAUTHORIZED
+    assert client.get("/api/me").get_json()["authenticated"] is False
+
+
+def test_login_success_and_me(client: FlaskClient, registered_user: dict):
     # make sure that the user isn't authenticated
     assert client.get("/api/me").get_json()["authenticated"] is False
 
-    # login to the same user
-    resp: Response = client.post("/api/login", json={"username": "carol", "password": "Testing123!)@"})
+    # login to an existing user
+    resp: Response = client.post("/api/login", json={"username": registered_user["username"], "password": registered_user["password"]})
     assert resp.status_code == HTTPStatus.OK
 
     # make sure that the request returned a jwt token
     assert "access_token=" in resp.headers.get("Set-Cookie", "")
 
     # make sure that the user is authenticated
-    resp: Response = client.get("/api/me")
-    assert resp.get_json()["authenticated"] is True
-    assert resp.get_json()["username"] == "carol"
-
-
-def test_login_wrong_password(client: FlaskClient):
-    # create a new user
-    client.post("/api/signup", json={"username": "dave", "email": "dave@example.com", "password": "Testing123!)@"})
+    data = client.get("/api/me").get_json()
+    assert data["authenticated"] is True
+    assert data["username"] == registered_user["username"]
 
-    # logout to clear cookie
-    client.post("/api/logout")
 
+def test_login_wrong_password(client: FlaskClient, registered_user: dict):
     # try logging in but with the wrong password
-    resp: Response = client.post("/api/login", json={"username": "dave", "password": "WrongPassword1234!)@"})
+    resp: Response = client.post("/api/login", json={"username": registered_user["username"], "password": "WrongPassword1234!)@"})
     # should return unauthorized error
     assert resp.status_code == HTTPStatus.UNAUTHORIZED
 
@@ -143,6 +177,22 @@ def test_signup_missing_fields(client: FlaskClient):
     assert "error" in data
 
 
+def test_signup_invalid_json_body(client: FlaskClient):
+    # a body that isn't a json object should be rejected
+    for body in (b"{not json", b"[1, 2]"):
+        resp: Response = client.post("/api/signup", data=body, content_type="application/json")
+        assert resp.status_code == HTTPStatus.BAD_REQUEST
+        assert resp.get_json()["error"] == "Invalid JSON body"
+
+
+def test_login_rejects_non_json_content_type(client: FlaskClient, registered_user: dict):
+    # a valid json body sent as a plain form post (as a cross-site form would) is rejected
+    body = orjson.dumps({"username": registered_user["username"], "password": registered_user["password"]})
+    resp: Response = client.post("/api/login", data=body, content_type="text/plain")
+    assert resp.status_code == HTTPStatus.BAD_REQUEST
+    assert "access_token=" not in resp.headers.get("Set-Cookie", "")
+
+
 def test_signup_invalid_email(client: FlaskClient):
     # Test invalid email format
     resp: Response = client.post(
@@ -155,69 +205,95 @@ def test_signup_invalid_email(client: FlaskClient):
     assert data["error"] == "Please enter a valid email address"
 
 
-@pytest.mark.parametrize(
-    "username, email, password, expected_error",
-    [
-        (
-            "A" * 65, # 65 chars
-            "long@example.com",
-            "Testing123!)@",
-            "Username must be at most 64 characters",
-        ),
-        (
-            "A",
-            f"{"a" * 249}@b.com", # 256 chars
-            "Testing123!)@",
-            "Please enter a valid email address",
-        ),
-        (
-            "short",
-            "short@example.com",
-            "Aa1!aa",  # 6 chars
-            "Password must be at least 8 characters",
-        ),
-        (
-            "toolong",
-            "toolong@example.com",
-            "A" * 129,  # 129 chars
-            "Password must be at most 128 characters",
-        ),
-        (
-            "noupper",
-            "noupper@example.com",
-            "lower1!lower",  # no uppercase
-            "Password must have at least one uppercase letter",
-        ),
-        (
-            "nolower",
-            "nolower@example.com",
-            "UPPER1!UP",  # no lowercase
-            "Password must have at least one lowercase letter",
-        ),
-        (
-            "nonumber",
-            "nonumber@example.com",
-            "NoDigits!AA",  # no digit
-            "Password must have at least one number",
-        ),
-        (
-            "nospecial",
-            "nospecial@example.com",
-            "Aa1aaaaa",  # no special char
-            "Password must have at least one special character",
-        ),
-    ],
-    ids=["username_too_long", "email_too_long", "too_short", "too_long", "missing_upper", "missing_lower", "missing_digit", "missing_special"],
-)
-def test_signup_rejects_invalid_registrations(client: FlaskClient, username: str, email: str, password: str, expected_error: str):
-    resp: Response = client.post(
-        "/api/signup",
-        json={"username": username, "email": email, "password": password},
-    )
-    assert resp.status_code == HTTPStatus.BAD_REQUEST
-    data = resp.get_json()
-    assert "error" in data
-    assert data["error"] == expected_error
+# (case, username, email, password, expected error)
+INVALID_REGISTRATIONS = [
+    (
+        "username_too_long",
+        "A" * 65, # 65 chars
+        "long@example.com",
+        "Testing123!)@",
+        "Username must be at most 64 characters",
+    ),
+    (
+        "email_too_long",
+        "A",
+        f"{"a" * 249}@b.com", # 256 chars
+        "Testing123!)@",
+        "Please enter a valid email address",
+    ),
+    (
+        "too_short",
+        "short",
+        "short@example.com",
+        "Aa1!aa",  # 6 chars
+        "Password must be at least 8 characters",
+    ),
+    (
+        "too_long",
+        "toolong",
+        "toolong@example.com",
+        "A" * 129,  # 129 chars
+        "Password must be at most 128 characters",
+    ),
+    (
+        "missing_upper",
+        "noupper",
+        "noupper@example.com",
+        "lower1!lower",  # no uppercase
+        "Password must have at least one uppercase letter",
+    ),
+    (
+        "missing_lower",
+        "nolower",
+        "nolower@example.com",
+        "UPPER1!UP",  # no lowercase
+        "Password must have at least one lowercase letter",
+    ),
+    (
+        "missing_digit",
+        "nonumber",
+        "nonumber@example.com",
+        "NoDigits!AA",  # no digit
+        "Password must have at least one number",
+    ),
+    (
+        "missing_special",
+        "nospecial",
+        "nospecial@example.com",
+        "Aa1aaaaa",  # no special char
+        "Password must have at least one special character",
+    ),
+]
+
+
+def test_signup_rejects_invalid_registrations(client: FlaskClient, subtests: pytest.Subtests):
+    # nothing is written for a rejected signup, so the cases share one test and client
+    # and each one still reports on its own
+    for case, username, email, password, expected_error in INVALID_REGISTRATIONS:
+        with subtests.test(case):
+            resp: Response = client.post(
+                "/api/signup",
+                json={"username": username, "email": email, "password": password},
+            )
+            assert resp.status_code == HTTPStatus.BAD_REQUEST
+            data = resp.get_json()
+            assert "error" in data
+            assert data["error"] == expected_error
+
+
+def test_me_reflects_committed_user_changes(app: Flask, client: FlaskClient):
+    # create a new user and cache their snapshot
+    client.post("/api/signup", json={"username": "heidi", "email": "heidi@example.com", "password": "Testing123!)@"})
+    data = client.get("/api/me").get_json()
+    assert data["points"] == 0
+
+    # change the user row outside of a request
+    with app.app_context():
+        assert User.apply_rating_reward(data["user_id"], 5) == (5, 0, False)
+        db.session.commit()
+
+    # the cached snapshot was dropped on commit
+    assert client.get("/api/me").get_json()["points"] == 5
 
 
 def test_remove_account_authenticated(client: FlaskClient):
@@ -244,6 +320,31 @@ def test_remove_account_authenticated(client: FlaskClient):
     assert resp.status_code == HTTPStatus.UNAUTHORIZED
 
 
+def test_login_fails_after_account_removed(client: FlaskClient):
+    # create a user and log in again
+    client.post("/api/signup", json={"username": "ivan", "email": "ivan@example.com", "password": "Testing123!)@"})
+    client.post("/api/logout")
+    resp: Response = client.post("/api/login", json={"username": "ivan", "password": "Testing123!)@"})
+    assert resp.status_code == HTTPStatus.OK
+
+    # the removed account can't log in anymore
+    assert client.post("/api/remove-account").status_code == HTTPStatus.OK
+    resp: Response = client.post("/api/login", json={"username": "ivan", "password": "Testing123!)@"})
+    assert resp.status_code == HTTPStatus.UNAUTHORIZED
+
+
+def test_refresh_token_of_missing_user_is_rejected(client: FlaskClient):
+    # create a user and drop their row directly, leaving the refresh token behind
+    client.post("/api/signup", json={"username": "judy", "email": "judy@example.com", "password": "Testing123!)@"})
+    db.session.execute(delete(User).where(User.username == "judy"))
+    db.session.commit()
+
+    # the orphaned token must not resolve to a user (sqlite may reuse the id)
+    client.delete_cookie("access_token")
+    resp: Response = client.post("/api/refresh")
+    assert resp.status_code == HTTPStatus.UNAUTHORIZED
+
+
 def test_remove_account_not_authenticated(client: FlaskClient):
     # try to delete an account when not authenticated
     resp: Response = client.post("/api/remove-account")
@@ -0,0 +1,347 @@
+import io, os
+from http import HTTPStatus
+from types import SimpleNamespace
+from datetime import date
+from PIL import Image
+from flask import Flask, url_for
+from flask.testing import FlaskClient
+from sqlalchemy import update
+
+from src.extensions import db
+from src.models import User, Post
+
+PASSWORD = "Testing123!)@"
+
+
+def sign_up(client: FlaskClient, username: str) -> int:
+    # create a new user, signed in on the client, and return their id
+    client.post("/api/signup", json={"username": username, "email": f"{username}@example.com", "password": PASSWORD})
+    return client.get("/api/me").get_json()["user_id"]
+
+
+def test_list_posts_cursor_pages_through_feed(app: Flask, client: FlaskClient):
+    # create a new user
+    user_id = sign_up(client, "paula")
+
+    # publish a few posts, two of them on the same day
+    with app.app_context():
+        posts = [
+            Post(user_id=user_id, hidden=False, recipe_title=f"Recipe {day}", recipe_message="...", date_posted=date(2020, 1, day))
+            for day in (1, 2, 2, 3, 4)
+        ]
+        db.session.add_all(posts)
+        db.session.commit()
+        expected = [post.id for post in sorted(posts, key=lambda p: (p.date_posted, p.id), reverse=True)]
+
+    # walk the feed two posts at a time until there is no next cursor
+    seen, cursor = [], ""
+    while cursor is not None:
+        resp = client.get("/api/posts", query_string={"cursor": cursor, "page_size": 2})
+        assert resp.status_code == HTTPStatus.OK
+        data = resp.get_json()
+        assert len(data["items"]) <= 2
+        seen += [item["id"] for item in data["items"]]
+        cursor = data["next_cursor"]
+
+    # every post shows up exactly once, newest first
+    assert [post_id for post_id in seen if post_id in expected] == expected
+
+    # page numbers still work and report totals
+    data = client.get("/api/posts", query_string={"page_size": 2}).get_json()
+    assert data["page"] == 1 and data["total_items"] >= len(expected)
+    assert all(item["username"] for item in data["items"])
+
+
+def walk(client: FlaskClient, url: str, key: str, **args) -> list[int]:
+    # follow next_cursor two posts at a time until the last page
+    seen, cursor = [], ""
+    while cursor is not None:
+        resp = client.get(url, query_string={"cursor": cursor, "page_size": 2, **args})
+        assert resp.status_code == HTTPStatus.OK
+        data = resp.get_json()
+        assert len(data[key]) <= 2
+        seen += [item["id"] for item in data[key]]
+        cursor = data["next_cursor"]
+    return seen
+
+
+def test_cursor_pages_by_rating_and_through_my_posts(app: Flask, client: FlaskClient):
+    user_id = sign_up(client, "walt")
+
+    # posts with repeated and missing ratings
+    with app.app_context():
+        posts = [
+            Post(user_id=user_id, hidden=False, recipe_title="Rated", recipe_message="...", rating=rating, date_posted=date(2021, 1, day))
+            for day, rating in enumerate((3.0, None, 5.0, 3.0, None, 1.0), start=1)
+        ]
+        db.session.add_all(posts)
+        db.session.commit()
+        # sqlite sorts unrated posts first
+        by_rating = [p.id for p in sorted(posts, key=lambda p: (p.rating is not None, p.rating or 0, p.id))]
+        newest_first = [p.id for p in sorted(posts, key=lambda p: (p.date_posted, p.id), reverse=True)]
+
+    # every post shows up exactly once, in both directions
+    for order, expected in (("asc", by_rating), ("desc", by_rating[::-1])):
+        seen = walk(client, "/api/posts", "items", sort_by="rating", order=order)
+        assert [post_id for post_id in seen if post_id in expected] == expected
+
+    # the user's own posts page the same way
+    assert walk(client, "/api/my-posts", "posts") == newest_first
+
+
+def test_list_posts_invalid_arguments(client: FlaskClient):
+    sign_up(client, "quinn")
+
+    resp = client.get("/api/posts", query_string={"cursor": "not-a-cursor"})
+    assert resp.status_code == HTTPStatus.BAD_REQUEST
+    assert resp.get_json()["error"] == "Invalid cursor"
+
+    # unknown sorts are rejected instead of falling back to the date
+    resp = client.get("/api/posts", query_string={"sort_by": "votes"})
+    assert resp.status_code == HTTPStatus.BAD_REQUEST
+    assert client.get("/api/posts", query_string={"order": "sideways"}).status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_is_valid_image_checks_jpeg_magic_bytes(app: Flask):
+    from src.endpoints.posts import is_valid_image
+
+    # write a real jpeg and a png
+    jpeg, png = io.BytesIO(), io.BytesIO()
+    Image.new("RGB", (4, 4)).save(jpeg, "JPEG")
+    Image.new("RGB", (4, 4)).save(png, "PNG")
+
+    # jpegs pass both the quick and the full check, and the stream is rewound
+    for verify in (False, True):
+        assert is_valid_image(jpeg, verify=verify)
+        assert jpeg.tell() == 0
+        assert not is_valid_image(png, verify=verify)
+
+    # a jpeg header on garbage only fails the full check
+    fake = io.BytesIO(b"\xff\xd8\xff" + b"\x00" * 64)
+    assert is_valid_image(fake)
+    assert not is_valid_image(fake, verify=True)
+    assert not is_valid_image(io.BytesIO(b""))
+
+
+def test_get_image_hands_off_to_nginx(app: Flask, client: FlaskClient):
+    user_id = sign_up(client, "rosa")
+
+    # a published post with an image
+    with app.app_context():
+        db.session.add(Post(user_id=user_id, hidden=False, recipe_title="Toast", recipe_message="...", image_id="rosa-toast"))
+        db.session.commit()
+
+    # with an internal location configured, nginx is told where to find the file
+    app.config["X_ACCEL_IMAGES"] = "/_protected_images/"
+    try:
+        resp = client.get("/api/images/rosa-toast.jpg")
+    finally:
+        app.config["X_ACCEL_IMAGES"] = None
+
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.headers["X-Accel-Redirect"] == "/_protected_images/rosa-toast.jpg"
+    assert resp.mimetype == "image/jpeg"
+    assert resp.cache_control.immutable and resp.cache_control.public
+
+    # the post links to the same image route
+    post_id = client.get("/api/my-posts").get_json()["posts"][0]["id"]
+    image_url = client.get(f"/api/posts/{post_id}").get_json()["image_url"]
+    with app.test_request_context():
+        assert image_url == url_for("api.get_image", image_id="rosa-toast", _external=True)
+
+
+def test_image_access_follows_publish_and_delete(app: Flask, client: FlaskClient):
+    user_id = sign_up(client, "sven")
+    with app.app_context():
+        post = Post(user_id=user_id, recipe_title="Soup", recipe_message="...", image_id="sven-soup")
+        db.session.add(post)
+        db.session.commit()
+        post_id = post.id
+
+    anon = app.test_client()
+    app.config["X_ACCEL_IMAGES"] = "/_protected_images/"
+    try:
+        # hidden, only the owner can see the image
+        assert anon.get("/api/images/sven-soup.jpg").status_code == HTTPStatus.NOT_FOUND
+        assert client.get("/api/images/sven-soup.jpg").status_code == HTTPStatus.OK
+
+        # publishing drops the cached access right away
+        client.post(f"/api/posts/{post_id}/publish")
+        assert anon.get("/api/images/sven-soup.jpg").status_code == HTTPStatus.OK
+
+        # and so does deleting
+        client.delete(f"/api/posts/{post_id}")
+        assert anon.get("/api/images/sven-soup.jpg").status_code == HTTPStatus.NOT_FOUND
+    finally:
+        app.config["X_ACCEL_IMAGES"] = None
+
+
+def test_admin_delete_checks_the_current_admin_flag(app: Flask, client: FlaskClient):
+    owner_id = sign_up(client, "vera")
+    with app.app_context():
+        posts = [Post(user_id=owner_id, recipe_title=title, recipe_message="...") for title in ("Bread", "Jam")]
+        db.session.add_all(posts)
+        db.session.commit()
+        first_id, second_id = (post.id for post in posts)
+
+    admin = app.test_client()
+    admin_id = sign_up(admin, "admin")
+
+    # the admin can delete anyone's post
+    assert admin.delete(f"/api/posts/{first_id}").status_code == HTTPStatus.OK
+
+    # revoke the flag without clearing the cached snapshot, as a commit on another worker would
+    with app.app_context():
+        db.session.execute(update(User).where(User.id == admin_id).values(admin=False))
+        db.session.commit()
+    assert admin.get("/api/me").get_json()["admin"] is True
+    assert admin.delete(f"/api/posts/{second_id}").status_code == HTTPStatus.FORBIDDEN
+
+
+def test_publish_and_delete_check_ownership(app: Flask, client: FlaskClient):
+    # two users, the post belongs to the first one
+    owner_id = sign_up(client, "tara")
+    with app.app_context():
+        post = Post(user_id=owner_id, recipe_title="Stew", recipe_message="...")
+        db.session.add(post)
+        db.session.commit()
+        post_id = post.id
+
+    other = app.test_client()
+    sign_up(other, "uma")
+
+    # someone else can't publish or delete it, missing posts are not found
+    assert other.post(f"/api/posts/{post_id}/publish").status_code == HTTPStatus.FORBIDDEN
+    assert other.delete(f"/api/posts/{post_id}").status_code == HTTPStatus.FORBIDDEN
+    assert client.post("/api/posts/999999/publish").status_code == HTTPStatus.NOT_FOUND
+    assert client.delete("/api/posts/999999").status_code == HTTPStatus.NOT_FOUND
+
+    # hidden posts are only cached privately
+    resp = client.get(f"/api/posts/{post_id}")
+    assert resp.cache_control.private and not resp.cache_control.public
+
+    # the owner can publish it, then it shows up in the (cached) feed
+    feed = lambda: [item["id"] for item in client.get("/api/posts", query_string={"page_size": 100}).get_json()["items"]]
+    assert post_id not in feed()
+    resp = client.post(f"/api/posts/{post_id}/publish")
+    assert resp.status_code == HTTPStatus.OK
+    assert resp.get_json()["post_id"] == post_id
+    assert post_id in feed()
+    resp = client.get(f"/api/posts/{post_id}")
+    assert resp.get_json()["hidden"] is False
+    assert resp.cache_control.public and resp.cache_control.max_age == 30
+
+    # an unchanged post revalidates with its etag
+    resp = client.get(f"/api/posts/{post_id}", headers={"If-None-Match": resp.headers["ETag"]})
+    assert resp.status_code == HTTPStatus.NOT_MODIFIED
+
+    # and delete it
+    assert client.delete(f"/api/posts/{post_id}").status_code == HTTPStatus.OK
+    assert client.get(f"/api/posts/{post_id}").status_code == HTTPStatus.NOT_FOUND
+    assert post_id not in feed()
+
+
+def test_generate_rating_replaces_image_and_rewards_owner(app: Flask, client: FlaskClient, monkeypatch):
+    from src import storage
+    from src.mcp import image_agent, ImageOutput
+
+    # stand in for the llm
+    output = ImageOutput(rating=4, response="Looks tasty", valid_image=True)
+    monkeypatch.setattr(image_agent, "run_sync", lambda prompt: SimpleNamespace(output=output))
+
+    user_id = sign_up(client, "vera")
+    with app.app_context():
+        post = Post(user_id=user_id, recipe_title="Pie", recipe_message="...")
+        db.session.add(post)
+        db.session.commit()
+        post_id = post.id
+
+    def upload():
+        jpeg = io.BytesIO()
+        Image.new("RGB", (4, 4)).save(jpeg, "JPEG")
+        jpeg.seek(0)
+        return client.post(f"/api/posts/{post_id}/generate-rating", data={"image": (jpeg, "pie.jpg")})
+
+    # rate the post twice
+    first = upload().get_json()
+    resp = upload()
+    assert resp.status_code == HTTPStatus.OK
+    second = resp.get_json()
+
+    # the owner got points for both ratings
+    assert second["rating"] == 4
+    assert (first["user_points"], second["user_points"]) == (4, 8)
+
+    # the post points at the new image, and the old one is gone
+    first_id = first["image_url"].rsplit("/", 1)[1].removesuffix(".jpg")
+    second_id = second["image_url"].rsplit("/", 1)[1].removesuffix(".jpg")
+    assert client.get(f"/api/posts/{post_id}").get_json()["image_url"] == second["image_url"]
+    storage.wait_for_discarded()
+    assert os.path.exists(storage.image_path(second_id))
+    assert not os.path.exists(storage.image_path(first_id))
+    os.unlink(storage.image_path(second_id))
+
+    # a rejected photo is saved alongside the rating but removed again
+    before = set(os.listdir(storage.IMAGE_DIR))
+    monkeypatch.setattr(image_agent, "run_sync", lambda prompt: SimpleNamespace(output=output.model_copy(update={"valid_image": False})))
+    assert upload().status_code == HTTPStatus.BAD_REQUEST
+    storage.wait_for_discarded()
+    assert set(os.listdir(storage.IMAGE_DIR)) == before
+
+    # another rating replaces the image while the agent runs, that one is removed instead
+    def overlapping_rating(prompt):
+        storage.save("vera-overlap", b"\xff\xd8\xff")
+        db.session.execute(update(Post).where(Post.id == post_id).values(image_id="vera-overlap"))
+        db.session.commit()
+        return SimpleNamespace(output=output)
+
+    monkeypatch.setattr(image_agent, "run_sync", overlapping_rating)
+    third = upload().get_json()
+    storage.wait_for_discarded()
+    assert not os.path.exists(storage.image_path("vera-overlap"))
+    os.unlink(storage.image_path(third["image_url"].rsplit("/", 1)[1].removesuffix(".jpg")))
+
+
+def test_removing_account_deletes_post_images(app: Flask, client: FlaskClient):
+    from src import storage
+
+    user_id = sign_up(client, "wren")
+    with app.app_context():
+        db.session.add(Post(user_id=user_id, recipe_title="Tart", recipe_message="...", image_id="wren-tart"))
+        db.session.commit()
+    storage.save("wren-tart", b"\xff\xd8\xff")
+
+    # a rolled back delete keeps the image
+    with app.app_context():
+        db.session.delete(db.session.scalar(db.select(Post).filter_by(image_id="wren-tart")))
+        db.session.flush()
+        db.session.rollback()
+    storage.wait_for_discarded()
+    assert os.path.exists(storage.image_path("wren-tart"))
+
+    # the account's posts go with it, and their images once that's committed
+    assert client.post("/api/remove-account").status_code == HTTPStatus.OK
+    storage.wait_for_discarded()
+    assert not os.path.exists(storage.image_path("wren-tart"))
+
+
+def test_removing_account_clears_feed_and_image_access(app: Flask, client: FlaskClient):
+    user_id = sign_up(client, "yara")
+    with app.app_context():
+        db.session.add(Post(user_id=user_id, hidden=False, recipe_title="Pie", recipe_message="...", image_id="yara-pie"))
+        db.session.commit()
+
+    # another user caches the feed page and the image's access
+    viewer = app.test_client()
+    sign_up(viewer, "zane")
+    app.config["X_ACCEL_IMAGES"] = "/_protected_images/"
+    try:
+        assert [item["username"] for item in viewer.get("/api/posts").get_json()["items"]] == ["yara"]
+        assert viewer.get("/api/images/yara-pie.jpg").status_code == HTTPStatus.OK
+
+        # the cascade delete of the account's posts clears both once it's committed
+        assert client.post("/api/remove-account").status_code == HTTPStatus.OK
+        assert viewer.get("/api/posts").get_json()["items"] == []
+        assert viewer.get("/api/images/yara-pie.jpg").status_code == HTTPStatus.NOT_FOUND
+    finally:
+        app.config["X_ACCEL_IMAGES"] = None
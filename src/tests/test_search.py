@@ -0,0 +1,66 @@
+import orjson
+from http import HTTPStatus
+from types import SimpleNamespace
+from flask.testing import FlaskClient
+
+
+def test_identical_searches_reuse_the_agent_result(client: FlaskClient, monkeypatch):
+    from src.mcp import search_agent, RecipeOutput
+
+    # stand in for the llm and count the calls
+    calls = []
+    recipe = RecipeOutput(title="Chicken Soup", message="Simmer.", image_url="", video_url="")
+    def run_sync(query):
+        calls.append(query)
+        return SimpleNamespace(output=recipe)
+    monkeypatch.setattr(search_agent, "run_sync", run_sync)
+
+    client.post("/api/signup", json={"username": "sam", "email": "sam@example.com", "password": "Testing123!)@"})
+
+    # the same query, differently cased and padded
+    first = client.post("/api/search", json={"query": "chicken soup"})
+    second = client.post("/api/search", json={"query": "  Chicken Soup "})
+    assert first.status_code == second.status_code == HTTPStatus.OK
+
+    # the agent only ran once, but each search still gets its own post
+    assert calls == ["chicken soup"]
+    first, second = first.get_json(), second.get_json()
+    assert second["title"] == "Chicken Soup"
+    assert first["post_id"] != second["post_id"]
+
+
+def test_mealdb_responses_are_cached(app, monkeypatch):
+    from src.mcp import search
+
+    # stand in for themealdb and count the requests
+    calls = []
+    def get(url, params, timeout):
+        calls.append((url, params))
+        return SimpleNamespace(raise_for_status=lambda: None, content=orjson.dumps({"meals": [{"idMeal": "52772", "strMeal": "Teriyaki Chicken"}]}))
+    monkeypatch.setattr(search._session, "get", get)
+
+    # the same search twice only goes out once
+    assert search.search_meal_by_name.function("teriyaki") == search.search_meal_by_name.function("teriyaki")
+    assert len(calls) == 1
+
+    # a different search is a different request
+    search.search_meal_by_main_ingredient.function("chicken")
+    assert len(calls) == 2
+
+
+def test_batch_lookup_returns_found_meals(app, monkeypatch):
+    from src.mcp import search
+
+    # only meal 1 exists
+    def get(url, params, timeout):
+        meals = [{
+            "idMeal": "1", "strMeal": "Pancakes", "strArea": "American", "strInstructions": "Whisk and fry.",
+            "strIngredient1": "Flour", "strMeasure1": "100g", "strIngredient2": "", "strMeasure2": "",
+            "strMealThumb": "https://example.com/pancakes.jpg", "strYoutube": "https://example.com/watch",
+        }] if params["i"] == 1 else None
+        return SimpleNamespace(raise_for_status=lambda: None, content=orjson.dumps({"meals": meals}))
+    monkeypatch.setattr(search._session, "get", get)
+
+    meals = search.lookup_meal_details_by_ids.function([1, 404])
+    assert [(meal.meal_name, meal.ingredients) for meal in meals] == [("Pancakes", [("Flour", "100g")])]
+    assert search.lookup_meal_details_by_id.function(404) is None
@@ -0,0 +1,4 @@
+from src.app import create_app
+
+# WSGI entrypoint for gunicorn (src.wsgi:app)
+app = create_app()